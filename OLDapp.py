@@ -30,10 +30,8 @@ def eur(x: float) -> str:
 def log_op(action: str, detail: str) -> None:
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{ts}] {action}: {detail}\n"
-    if LOG_FILE.exists():
-        LOG_FILE.write_text(LOG_FILE.read_text(encoding="utf-8") + line, encoding="utf-8")
-    else:
-        LOG_FILE.write_text(line, encoding="utf-8")
+    with open(LOG_FILE, "a", encoding="utf-8") as f:
+        f.write(line)
 
 
 def save_data(data: dict) -> None:
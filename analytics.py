@@ -0,0 +1,89 @@
+"""Analítica multi-año: todos los años en una única tabla de items.
+
+La tabla se construye una vez a partir del backend de almacenamiento y
+sobre ella se precalculan los agregados mes × categoría × cuenta que usa
+la pestaña de Tendencias.
+"""
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+
+from storage import available_years, open_storage, year_months
+
+ITEM_TABLE_COLUMNS = ["year", "month", "month_key", "tid", "name", "amount", "account_id",
+                      "account_name", "category", "due", "paid", "type", "is_adhoc"]
+ROLLUP_KEYS = ["year", "month", "month_key", "category", "account_name"]
+# Agrupaciones del timeline: None deja un punto por item
+TIMELINE_FREQS = {"item": None, "day": "D", "week": "W-MON"}
+
+
+def load_items_table(backend: str, data_dir: Path) -> pd.DataFrame:
+    """Todos los items de todos los años en un DataFrame columnar.
+
+    Incluye los meses que aún son vistas de la plantilla, igual que la app.
+    """
+    records = []
+    for year in available_years(backend, data_dir):
+        data = open_storage(backend, data_dir, year).load()
+        if data is None:
+            continue
+        acc_map = {a["id"]: a["name"] for a in data["accounts"]}
+        for month, month_data in year_months(data).items():
+            key = f"{year:04d}-{month:02d}"
+            for item in month_data["items"]:
+                records.append((
+                    year, month, key, item["tid"], item["name"], float(item["amount"]),
+                    item["account_id"], acc_map.get(item["account_id"]), item.get("category", "Otros"),
+                    item["due"], bool(item["paid"]), item.get("type"), bool(item.get("is_adhoc")),
+                ))
+    items = pd.DataFrame.from_records(records, columns=ITEM_TABLE_COLUMNS)
+    items["due"] = pd.to_datetime(items["due"])
+    for col in ("category", "account_name", "type"):
+        items[col] = items[col].astype("category")
+    return items
+
+
+def rollup(items: pd.DataFrame) -> pd.DataFrame:
+    """Agregado mes × categoría × cuenta (total, pagado, pendiente, nº items)"""
+    if items.empty:
+        return pd.DataFrame(columns=[*ROLLUP_KEYS, "total", "paid_amount", "pending_amount", "items"])
+    work = items.assign(paid_amount=items["amount"].where(items["paid"], 0.0))
+    cube = work.groupby(ROLLUP_KEYS, observed=True).agg(
+        total=("amount", "sum"),
+        paid_amount=("paid_amount", "sum"),
+        items=("amount", "size"),
+    ).reset_index()
+    cube["pending_amount"] = cube["total"] - cube["paid_amount"]
+    return cube
+
+
+def trend(cube: pd.DataFrame, by: str, years: Optional[List[int]] = None,
+          value: str = "total") -> pd.DataFrame:
+    """Serie mensual de `value` por `by` ("category" o "account_name").
+
+    Devuelve una tabla month_key × grupo a partir del agregado precalculado.
+    """
+    if years is not None:
+        cube = cube[cube["year"].isin(years)]
+    return cube.pivot_table(index="month_key", columns=by, values=value,
+                            aggfunc="sum", fill_value=0.0, observed=True).sort_index()
+
+
+def timeline(items: pd.DataFrame, group: str = "day") -> pd.DataFrame:
+    """Importes pagados/pendientes por fecha de vencimiento y su acumulado.
+
+    group: "item" (una fila por item), "day" o "week" (semanas que empiezan
+    en lunes, etiquetadas por ese lunes). Los periodos sin importes se omiten.
+    """
+    work = items[["due", "amount", "paid"]].sort_values("due")
+    paid = work["amount"].where(work["paid"], 0.0)
+    table = pd.DataFrame({"due": work["due"], "paid": paid, "pending": work["amount"] - paid})
+    freq = TIMELINE_FREQS[group]
+    if freq is not None:
+        table = (table.groupby(pd.Grouper(key="due", freq=freq, label="left", closed="left"))
+                 .sum().reset_index())
+        table = table[(table["paid"] != 0) | (table["pending"] != 0)]
+    table["total"] = table["paid"] + table["pending"]
+    table["acumulado"] = table["total"].cumsum()
+    return table.reset_index(drop=True)
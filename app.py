@@ -1,13 +1,14 @@
-import json
 import calendar
-from pathlib import Path
-from datetime import date, datetime, timedelta
-from typing import List, Dict, Any, Optional
+from datetime import date, timedelta
+from typing import Dict, Any
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+
+import core
+from core import TEMPLATE_TYPES, DataStore, FinanceManager, get_oplog, log_op
+from storage import BACKUP_SUFFIXES, StorageError, available_years, decode_backup
+from views import eur
 
 # -----------------------
 # Configuración y Constantes
@@ -19,10 +20,14 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-BASE_DIR = Path(__file__).resolve().parent
-DATA_DIR = BASE_DIR / "data"
-DATA_DIR.mkdir(exist_ok=True)
-LOG_FILE = DATA_DIR / "operaciones.txt"
+# Años seleccionables en la app
+FISCAL_YEARS = [2025, 2026, 2027]
+# Cada cuántos segundos comprueba una sesión si otra modificó los datos
+REVISION_POLL_SECONDS = 5
+# Tipo MIME de cada formato de copia de seguridad
+BACKUP_MIME_TYPES = {"json": "application/json", "gzip": "application/gzip", "zip": "application/zip"}
+# Vistas de la navegación principal (solo se dibuja la seleccionada)
+VIEWS = ["📝 Operaciones", "📊 Análisis", "💰 Cuentas", "📁 Categorías", "📈 Tendencias", "⚙️ Plantilla"]
 
 # -----------------------
 # Estilos CSS Mejorados
@@ -131,220 +136,71 @@ st.markdown("""
 # -----------------------
 # Utilidades
 # -----------------------
-def eur(x: float) -> str:
-    """Formato moneda europea"""
-    return f"{x:,.2f} €".replace(",", "X").replace(".", ",").replace("X", ".")
-
-def log_op(action: str, detail: str) -> None:
-    """Registro de auditoría simple"""
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"[{ts}] {action}: {detail}\n"
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line)
-
-def get_status_emoji(gap: float) -> str:
-    """Devuelve emoji según disponibilidad"""
-    if gap >= 100:
-        return "✅"
-    elif gap >= 0:
-        return "⚠️"
-    else:
-        return "🔴"
-
 def get_month_progress() -> float:
     """Calcula el progreso del mes actual (0-1)"""
     today = date.today()
     last_day = calendar.monthrange(today.year, today.month)[1]
     return today.day / last_day
 
-# -----------------------
-# Lógica de Negocio (Clase Gestora)
-# -----------------------
-class FinanceManager:
-    def __init__(self, year: int):
-        self.year = year
-        self.file_path = DATA_DIR / f"control_pagos_{year}.json"
-        self.data = self._load_or_create()
-
-    def _load_or_create(self) -> Dict[str, Any]:
-        if self.file_path.exists():
-            try:
-                return json.loads(self.file_path.read_text(encoding="utf-8"))
-            except json.JSONDecodeError:
-                st.error(f"Error leyendo {self.file_path}. Iniciando vacío.")
-        
-        # Estructura inicial por defecto
-        return {
-            "year": self.year,
-            "control_day": 29,
-            "next_id": 1000,
-            "balances": {
-                "1": 0.0, "2": 0.0, "3": 0.0, "4": 0.0, "5": 0.0
-            },
-            "accounts": [
-                {"id": 1, "name": "BBVA – Ydaliz", "color": "#072146"},
-                {"id": 2, "name": "BBVA – Moisés", "color": "#072146"},
-                {"id": 3, "name": "Caixa – Conjunta", "color": "#0066b3"},
-                {"id": 4, "name": "Santander – Ydaliz", "color": "#ec0000"},
-                {"id": 5, "name": "Santander – Moisés", "color": "#ec0000"},
-            ],
-            "categories": [
-                "Vivienda", "Transporte", "Alimentación", "Suscripciones", 
-                "Seguros", "Educación", "Salud", "Ocio", "Otros"
-            ],
-            "template": [],
-            "months": {}
-        }
-
-    def save(self):
-        self.file_path.write_text(json.dumps(self.data, ensure_ascii=False, indent=2), encoding="utf-8")
-
-    def get_accounts(self) -> Dict[int, str]:
-        return {a["id"]: a["name"] for a in self.data["accounts"]}
-
-    def get_month_key(self, month: int) -> str:
-        return f"{self.year:04d}-{month:02d}"
-
-    def ensure_month_exists(self, month: int):
-        key = self.get_month_key(month)
-        if key in self.data["months"]:
-            return
-
-        # Generar mes desde plantilla
-        items = []
-        for t in self.data.get("template", []):
-            # Filtro para anuales
-            if t.get("type") == "sub_annual" and int(t.get("annual_month", 0)) != month:
-                continue
-            
-            # Calcular fecha
-            last_day = calendar.monthrange(self.year, month)[1]
-            day = min(max(1, int(t.get("day", 1))), last_day)
-            due_date = f"{self.year:04d}-{month:02d}-{day:02d}"
-
-            items.append({
-                "tid": int(t["id"]),
-                "name": t["name"],
-                "amount": float(t["amount"]),
-                "account_id": int(t["account_id"]),
-                "category": t.get("category", "Otros"),
-                "due": due_date,
-                "paid": False,
-                "paid_date": None,
-                "type": t["type"],
-                "is_adhoc": False,
-                "notes": ""
-            })
-
-        self.data["months"][key] = {
-            "year": self.year, 
-            "month": month, 
-            "items": items
-        }
-        self.save()
-        log_op("NEW_MONTH", f"Mes {key} generado.")
-
-    def add_adhoc_expense(self, month: int, name: str, amount: float, day: int, 
-                         account_id: int, category: str = "Otros", notes: str = ""):
-        """Añade un gasto puntual solo a este mes"""
-        key = self.get_month_key(month)
-        self.ensure_month_exists(month)
-        
-        last_day = calendar.monthrange(self.year, month)[1]
-        day_safe = min(max(1, day), last_day)
-        
-        new_id = self.data["next_id"]
-        self.data["next_id"] += 1
-        
-        item = {
-            "tid": new_id,
-            "name": name,
-            "amount": round(float(amount), 2),
-            "account_id": int(account_id),
-            "category": category,
-            "due": f"{self.year:04d}-{month:02d}-{day_safe:02d}",
-            "paid": False,
-            "paid_date": None,
-            "type": "adhoc",
-            "is_adhoc": True,
-            "notes": notes
-        }
-        
-        self.data["months"][key]["items"].append(item)
-        self.save()
-        log_op("ADD_ADHOC", f"{name} ({amount}€) añadido a {key}")
-        return True
-
-    def delete_item(self, month: int, tid: int):
-        """Elimina un item del mes"""
-        key = self.get_month_key(month)
-        if key in self.data["months"]:
-            items = self.data["months"][key]["items"]
-            self.data["months"][key]["items"] = [i for i in items if i["tid"] != tid]
-            self.save()
-            log_op("DELETE", f"Item {tid} eliminado de {key}")
-
-    def update_balance(self, account_id: int, amount: float, operation: str):
-        """operation: 'subtract' (pago) or 'add' (reembolso/ingreso)"""
-        acc_str = str(account_id)
-        current = float(self.data["balances"].get(acc_str, 0.0))
-        if operation == 'subtract':
-            self.data["balances"][acc_str] = round(current - amount, 2)
-        else:
-            self.data["balances"][acc_str] = round(current + amount, 2)
-        self.save()
-
-    def get_items_df(self, month: int) -> pd.DataFrame:
-        key = self.get_month_key(month)
-        if key not in self.data["months"]:
-            return pd.DataFrame()
-        
-        items = self.data["months"][key]["items"]
-        if not items:
-            return pd.DataFrame()
-
-        df = pd.DataFrame(items)
-        # Enriquecer con nombres de cuenta
-        acc_map = self.get_accounts()
-        df["account_name"] = df["account_id"].map(acc_map)
-        
-        # Convertir fechas
-        df["due"] = pd.to_datetime(df["due"])
-        if "paid_date" in df.columns:
-            df["paid_date"] = pd.to_datetime(df["paid_date"], errors='coerce')
-        
-        return df.sort_values("due")
-    
-    def get_category_summary(self, month: int) -> pd.DataFrame:
-        """Resumen por categorías"""
-        df = self.get_items_df(month)
-        if df.empty:
-            return pd.DataFrame()
-        
-        summary = df.groupby("category").agg({
-            "amount": "sum",
-            "paid": lambda x: (x == True).sum()
-        }).reset_index()
-        summary.columns = ["Categoría", "Total", "Pagados"]
-        summary["Pendientes"] = summary.apply(lambda row: 
-            len(df[(df["category"] == row["Categoría"]) & (~df["paid"])]), axis=1)
-        return summary.sort_values("Total", ascending=False)
+@st.cache_resource(show_spinner=False)
+def get_store() -> DataStore:
+    """Almacén compartido por todas las sesiones del proceso"""
+    return DataStore()
+
+def get_manager(year: int) -> FinanceManager:
+    """Devuelve el gestor compartido del año"""
+    return get_store().manager(year)
+
+@st.fragment
+def render_backup(selected_year: int, selected_month: int):
+    """Descarga de copias; el fichero se genera solo al pulsar el botón"""
+    # core.DATA_DIR se lee al llamar: set_data_dir() puede haberlo cambiado tras importar
+    years = sorted(set(available_years(core.STORAGE_BACKEND, core.DATA_DIR)) | {selected_year})
+    fmt = st.radio(
+        "Formato",
+        list(BACKUP_SUFFIXES),
+        format_func=lambda f: BACKUP_SUFFIXES[f].lstrip(".").upper(),
+        horizontal=True,
+        key="backup_format"
+    )
+    if len(years) > 1:
+        first, last = st.select_slider("Años", years, value=(selected_year, selected_year),
+                                       key="backup_years")
+    else:
+        first = last = selected_year
+    span = [y for y in years if first <= y <= last]
+    if len(span) > 1 and fmt != "zip":
+        st.caption("Varios años: se descargan en un ZIP")
+        fmt = "zip"
+    
+    if span == [selected_year]:
+        file_name = f"backup_{selected_year}_{selected_month:02d}{BACKUP_SUFFIXES[fmt]}"
+    else:
+        file_name = f"backup_{first}-{last}{BACKUP_SUFFIXES[fmt]}"
+    store = get_store()
+    st.download_button(
+        "💾 Descargar",
+        # Callable: se serializa al hacer clic, no en cada rerun
+        data=lambda: store.backup(span, fmt),
+        file_name=file_name,
+        mime=BACKUP_MIME_TYPES[fmt],
+        use_container_width=True
+    )
 
-    def get_upcoming_payments(self, days: int = 7) -> pd.DataFrame:
-        """Pagos próximos en los próximos N días"""
-        today = date.today()
-        month = today.month
-        df = self.get_items_df(month)
-        
-        if df.empty:
-            return pd.DataFrame()
-        
-        # Filtrar no pagados y próximos
-        df_pending = df[~df["paid"]].copy()
-        df_pending["days_until"] = (df_pending["due"] - pd.Timestamp(today)).dt.days
-        
-        upcoming = df_pending[df_pending["days_until"] <= days].copy()
-        return upcoming.sort_values("days_until")
+@st.fragment(run_every=REVISION_POLL_SECONDS)
+def watch_revision(year: int):
+    """Refresca la página cuando otra sesión cambió los datos del año.
+
+    Solo compara números de revisión; el rerun completo se lanza únicamente
+    si la revisión difiere de la que pintó esta sesión.
+    """
+    store = get_store()
+    store.manager(year)
+    revision = store.revision(year)
+    seen = st.session_state.get("seen_revision")
+    if seen is not None and seen != (year, revision):
+        st.rerun(scope="app")
+    st.caption(f"🔄 Revisión {revision}")
 
 # -----------------------
 # Componentes UI Reutilizables
@@ -352,15 +208,15 @@ class FinanceManager:
 
 def render_quick_stats(manager: FinanceManager, selected_month: int):
     """Panel de estadísticas rápidas mejorado"""
-    df_items = manager.get_items_df(selected_month)
+    totals = manager.month_totals(selected_month)
     
-    if df_items.empty:
+    if totals.count == 0:
         st.info("📝 No hay gastos registrados para este mes. ¡Comienza agregando tu primer gasto!")
         return
     
-    total_month = df_items["amount"].sum()
-    paid_month = df_items[df_items["paid"]]["amount"].sum()
-    pending_month = total_month - paid_month
+    total_month = totals.total
+    paid_month = totals.paid
+    pending_month = totals.pending
     progress = (paid_month / total_month) if total_month > 0 else 0
     
     # Métricas principales
@@ -385,7 +241,7 @@ def render_quick_stats(manager: FinanceManager, selected_month: int):
         st.metric(
             "⏳ Pendiente", 
             eur(pending_month),
-            delta=f"{len(df_items[~df_items['paid']])} items",
+            delta=f"{totals.pending_count} items",
             delta_color="inverse"
         )
     
@@ -419,6 +275,7 @@ def render_quick_stats(manager: FinanceManager, selected_month: int):
                 urgency = "🔴" if days <= 2 else "🟡" if days <= 5 else "🟢"
                 st.write(f"{urgency} **{row['name']}** - {eur(row['amount'])} - {row['account_name']} - En {days} días")
 
+@st.fragment
 def render_payment_manager(manager: FinanceManager, selected_month: int, auto_deduct: bool):
     """Gestor de pagos mejorado con filtros y búsqueda"""
     
@@ -441,11 +298,11 @@ def render_payment_manager(manager: FinanceManager, selected_month: int, auto_de
         )
     
     with col_filter2:
-        categories = ["Todas"] + sorted(df_items["category"].unique().tolist())
+        categories = ["Todas"] + df_items["category"].cat.remove_unused_categories().cat.categories.tolist()
         filter_cat = st.selectbox("Categoría", categories, key="filter_cat")
     
     with col_filter3:
-        accounts = ["Todas"] + sorted(df_items["account_name"].unique().tolist())
+        accounts = ["Todas"] + df_items["account_name"].cat.remove_unused_categories().cat.categories.tolist()
         filter_acc = st.selectbox("Cuenta", accounts, key="filter_acc")
     
     with col_filter4:
@@ -475,8 +332,15 @@ def render_payment_manager(manager: FinanceManager, selected_month: int, auto_de
         st.info("No se encontraron resultados con los filtros aplicados")
         return
     
+    # Cuenta asignada a las filas nuevas del editor
+    acc_ids = {a["name"]: a["id"] for a in manager.data["accounts"]}
+    default_account = acc_ids.get(filter_acc, manager.data["accounts"][0]["id"])
+    if "editor_nonce" not in st.session_state:
+        st.session_state.editor_nonce = 0
+    editor_key = f"editor_{selected_month}_{st.session_state.editor_nonce}"
+    
     # Editor de datos mejorado
-    edited_df = st.data_editor(
+    st.data_editor(
         df_filtered,
         column_config={
             "paid": st.column_config.CheckboxColumn(
@@ -530,15 +394,18 @@ def render_payment_manager(manager: FinanceManager, selected_month: int, auto_de
         use_container_width=True,
         disabled=["account_name"],
         num_rows="dynamic",  # Permite añadir/eliminar filas
-        key=f"editor_{selected_month}"
+        key=editor_key
     )
+    st.caption("Las filas nuevas se guardan como gastos puntuales en la cuenta filtrada "
+               "(o en la primera cuenta si no hay filtro).")
     
     # Botones de acción
     col_btn1, col_btn2, col_btn3, col_btn4 = st.columns(4)
     
     with col_btn1:
         if st.button("💾 Guardar Cambios", type="primary", use_container_width=True):
-            save_changes(manager, selected_month, df_items, edited_df, auto_deduct)
+            save_changes(manager, selected_month, df_filtered,
+                         st.session_state.get(editor_key, {}), auto_deduct, default_account)
     
     with col_btn2:
         if st.button("✅ Marcar Todos Pagados", use_container_width=True):
@@ -559,42 +426,114 @@ def render_payment_manager(manager: FinanceManager, selected_month: int, auto_de
                 "text/csv"
             )
 
-def save_changes(manager: FinanceManager, month: int, original_df: pd.DataFrame, 
-                edited_df: pd.DataFrame, auto_deduct: bool):
-    """Guarda cambios del editor"""
-    changes_log = []
-    key = manager.get_month_key(month)
-    original_items = manager.data["months"][key]["items"]
-    items_map = {i["tid"]: i for i in original_items}
-    
-    for index, row in edited_df.iterrows():
-        tid = row["tid"]
-        if tid in items_map:
-            current_item = items_map[tid]
-            
-            # Detectar cambio de estado pagado
-            was_paid = current_item["paid"]
-            is_paid = row["paid"]
-            
-            if was_paid != is_paid:
-                current_item["paid"] = is_paid
-                current_item["paid_date"] = str(date.today()) if is_paid else None
-                
-                if auto_deduct:
-                    op = 'subtract' if is_paid else 'add'
-                    manager.update_balance(current_item["account_id"], current_item["amount"], op)
-                    changes_log.append(f"{'✅ Pagado' if is_paid else '↩️ Revertido'}: {current_item['name']}")
-            
-            # Actualizar otros campos
-            current_item["amount"] = float(row["amount"])
-            current_item["due"] = str(row["due"])
-            current_item["category"] = row.get("category", "Otros")
-            current_item["notes"] = row.get("notes", "")
-    
-    manager.save()
+# Columnas que el editor de pagos puede modificar
+EDITABLE_COLUMNS = ["paid", "name", "amount", "due", "category", "notes"]
+
+def _normalize_editable(df: pd.DataFrame) -> pd.DataFrame:
+    """Columnas editables indexadas por tid con tipos comparables"""
+    out = df.set_index("tid")[EDITABLE_COLUMNS].copy()
+    out["paid"] = out["paid"].fillna(False).astype(bool)
+    out["name"] = out["name"].fillna("").astype(str)
+    out["amount"] = out["amount"].astype(float).round(2)
+    out["due"] = pd.to_datetime(out["due"]).dt.strftime("%Y-%m-%d")
+    out["category"] = out["category"].astype(object).fillna("Otros").astype(str)
+    out["notes"] = out["notes"].fillna("").astype(str)
+    return out
+
+def diff_items(original_df: pd.DataFrame, edited_df: pd.DataFrame) -> pd.DataFrame:
+    """Compara columna a columna el editor con los datos originales.
+
+    Devuelve una fila por tid modificado con los valores nuevos, una
+    columna booleana `<col>_changed` por campo editable y el
+    `account_id`/`amount_old` originales para calcular saldos. Las filas
+    sin tid (altas del editor) se ignoran.
+    """
+    edited_df = edited_df[edited_df["tid"].notna()].astype({"tid": int})
+    old = _normalize_editable(original_df)
+    new = _normalize_editable(edited_df)
+    old = old.loc[old.index.intersection(new.index)]
+    new = new.loc[old.index]
+    
+    changed = new.ne(old)
+    mask = changed.any(axis=1)
+    result = new[mask].copy()
+    for col in EDITABLE_COLUMNS:
+        result[f"{col}_changed"] = changed.loc[mask, col]
+    info = original_df.set_index("tid").loc[result.index, ["account_id", "amount"]]
+    result["account_id"] = info["account_id"]
+    result["amount_old"] = info["amount"]
+    return result.reset_index()
+
+def balance_deltas(changes: pd.DataFrame) -> Dict[int, float]:
+    """Ajuste de saldo por cuenta de los cambios de estado pagado"""
+    toggled = changes[changes["paid_changed"]]
+    if toggled.empty:
+        return {}
+    signed = toggled["amount_old"].where(~toggled["paid"], -toggled["amount_old"])
+    return signed.groupby(toggled["account_id"]).sum().round(2).to_dict()
+
+def editor_changes(view_df: pd.DataFrame, edited_rows: Dict[Any, Dict[str, Any]]) -> pd.DataFrame:
+    """Cambios de las filas tocadas en el editor (edited_rows de st.data_editor).
+
+    Solo se construyen y comparan las filas editadas; las posiciones se
+    refieren a las filas de `view_df` tal y como se pasaron al editor.
+    """
+    positions = sorted(int(p) for p in edited_rows)
+    original = view_df.iloc[positions]
+    edited = original.astype(object)
+    for pos, cols in edited_rows.items():
+        label = view_df.index[int(pos)]
+        for col, value in cols.items():
+            if col in edited.columns:
+                edited.at[label, col] = value
+    return diff_items(original, edited)
+
+def _reset_editor():
+    """Descarta el estado del editor (las posiciones dejan de ser válidas)"""
+    st.session_state.editor_nonce = st.session_state.get("editor_nonce", 0) + 1
+
+def save_changes(manager: FinanceManager, month: int, view_df: pd.DataFrame,
+                editor_state: Dict[str, Any], auto_deduct: bool, default_account: int):
+    """Guarda cambios del editor a partir de su delta (editadas/añadidas/borradas)"""
+    changes = editor_changes(view_df, editor_state.get("edited_rows", {}))
+    added_rows = editor_state.get("added_rows", [])
+    deleted_tids = [int(view_df.iloc[int(pos)]["tid"]) for pos in editor_state.get("deleted_rows", [])]
+    today = str(date.today())
+    
+    updates = {}
+    for row in changes.to_dict("records"):
+        fields = {col: row[col] for col in EDITABLE_COLUMNS if row[f"{col}_changed"]}
+        if "paid" in fields:
+            fields["paid_date"] = today if row["paid"] else None
+        updates[int(row["tid"])] = fields
+    
+    deltas = balance_deltas(changes) if auto_deduct else {}
+    added = 0
+    with manager.transaction():
+        manager.apply_item_changes(month, updates, deltas)
+        for row in added_rows:
+            if not row.get("name"):
+                continue
+            due = pd.Timestamp(row["due"]) if row.get("due") else pd.Timestamp(date.today())
+            tid = manager.add_adhoc_expense(
+                month, row["name"], float(row.get("amount") or 0.0), due.day,
+                default_account, row.get("category") or "Otros", row.get("notes") or ""
+            )
+            if row.get("paid"):
+                manager.set_paid(month, tid, True, auto_deduct)
+            added += 1
+        manager.delete_items(month, deleted_tids)
+    _reset_editor()
     
-    if changes_log:
-        st.success(f"✅ {len(changes_log)} cambios guardados")
+    changes_log = []
+    if auto_deduct:
+        toggled = changes[changes["paid_changed"]]
+        changes_log = [f"{'✅ Pagado' if paid else '↩️ Revertido'}: {name}"
+                       for name, paid in zip(toggled["name"], toggled["paid"])]
+    
+    total = len(updates) + added + len(deleted_tids)
+    if total:
+        st.success(f"✅ {total} cambios guardados")
         for ch in changes_log:
             log_op("UPDATE", ch)
     else:
@@ -605,23 +544,17 @@ def save_changes(manager: FinanceManager, month: int, original_df: pd.DataFrame,
 def mark_all_paid(manager: FinanceManager, month: int, df: pd.DataFrame, auto_deduct: bool):
     """Marca todos los items pendientes como pagados"""
     key = manager.get_month_key(month)
-    items = manager.data["months"][key]["items"]
-    items_map = {i["tid"]: i for i in items}
-    
-    count = 0
-    for _, row in df[~df["paid"]].iterrows():
-        tid = row["tid"]
-        if tid in items_map:
-            item = items_map[tid]
-            item["paid"] = True
-            item["paid_date"] = str(date.today())
-            
-            if auto_deduct:
-                manager.update_balance(item["account_id"], item["amount"], 'subtract')
-            
-            count += 1
+    pending = df[~df["paid"]]
+    today = str(date.today())
+    
+    updates = {int(tid): {"paid": True, "paid_date": today} for tid in pending["tid"]}
+    deltas = {}
+    if auto_deduct:
+        deltas = (-pending.groupby("account_id")["amount"].sum()).round(2).to_dict()
+    manager.apply_item_changes(month, updates, deltas)
+    _reset_editor()
     
-    manager.save()
+    count = len(updates)
     st.success(f"✅ {count} pagos marcados como completados")
     log_op("BULK_PAID", f"{count} items marcados en {key}")
     st.rerun()
@@ -635,14 +568,106 @@ def delete_paid_adhoc(manager: FinanceManager, month: int, df: pd.DataFrame):
         st.info("No hay gastos puntuales pagados para eliminar")
         return
     
-    items = manager.data["months"][key]["items"]
-    manager.data["months"][key]["items"] = [i for i in items if i["tid"] not in to_delete]
-    manager.save()
+    manager.delete_items(month, to_delete)
+    _reset_editor()
     
     st.success(f"🗑️ {len(to_delete)} gastos puntuales eliminados")
     log_op("DELETE_ADHOC", f"{len(to_delete)} items borrados de {key}")
     st.rerun()
 
+@st.fragment
+def render_template(manager: FinanceManager, selected_month: int):
+    """Editor de la plantilla de gastos recurrentes"""
+    st.subheader("⚙️ Plantilla de Gastos Recurrentes")
+    st.info("💡 Los cambios aquí afectarán a los meses FUTUROS que aún no hayas modificado, no al mes actual ni a los anteriores.")
+    
+    current_template = manager.data.get("template", [])
+    
+    if not current_template:
+        st.warning("No hay gastos recurrentes configurados")
+        df_template = pd.DataFrame(columns=[
+            "id", "name", "amount", "account_id", "category", 
+            "day", "type", "annual_month"
+        ])
+    else:
+        df_template = pd.DataFrame(current_template)
+    
+    edited_template = st.data_editor(
+        df_template,
+        num_rows="dynamic",
+        use_container_width=True,
+        key="template_editor",
+        column_config={
+            "id": st.column_config.NumberColumn("ID", disabled=True),
+            "name": st.column_config.TextColumn("Concepto", required=True),
+            "amount": st.column_config.NumberColumn("Importe (€)", format="%.2f", required=True),
+            "account_id": st.column_config.SelectboxColumn(
+                "Cuenta ID",
+                options=[a["id"] for a in manager.data["accounts"]],
+                required=True
+            ),
+            "category": st.column_config.SelectboxColumn(
+                "Categoría",
+                options=manager.data.get("categories", ["Otros"])
+            ),
+            "day": st.column_config.NumberColumn(
+                "Día del Mes",
+                min_value=1,
+                max_value=31,
+                required=True
+            ),
+            "type": st.column_config.SelectboxColumn(
+                "Tipo",
+                options=TEMPLATE_TYPES,
+                required=True
+            ),
+            "annual_month": st.column_config.NumberColumn(
+                "Mes (Si Anual)",
+                min_value=0,
+                max_value=12,
+                help="Solo para tipo 'sub_annual'. 0 = no aplica"
+            ),
+        }
+    )
+    
+    col_save, col_reset = st.columns([1, 1])
+    
+    with col_save:
+        if st.button("💾 Guardar Plantilla", type="primary", use_container_width=True):
+            new_tpl = edited_template.to_dict(orient="records")
+            
+            with manager.transaction():
+                # Limpiar y validar
+                for item in new_tpl:
+                    if pd.isna(item.get("id")):
+                        item["id"] = manager.allocate_id()
+                    else:
+                        item["id"] = int(item["id"])
+                    
+                    item["account_id"] = int(item["account_id"])
+                    item["amount"] = float(item["amount"])
+                    item["day"] = int(item["day"])
+                    item["category"] = item.get("category", "Otros")
+                    item["annual_month"] = int(item.get("annual_month", 0))
+                
+                manager.set_template(new_tpl)
+            st.success("✅ Plantilla actualizada correctamente")
+            log_op("TEMPLATE_UPDATE", f"{len(new_tpl)} items en plantilla")
+            st.rerun()
+    
+    with col_reset:
+        if st.button("🔄 Regenerar Mes Actual", use_container_width=True):
+            if st.session_state.get('confirm_regenerate'):
+                # Eliminar mes actual y regenerar
+                manager.regenerate_month(selected_month)
+                st.success("✅ Mes regenerado desde plantilla")
+                st.session_state.confirm_regenerate = False
+                st.rerun()
+            else:
+                st.session_state.confirm_regenerate = True
+                st.warning("⚠️ Esto eliminará todos los cambios del mes actual. Haz clic de nuevo para confirmar.")
+
+
 # -----------------------
 # Interfaz Principal
 # -----------------------
@@ -659,13 +684,19 @@ def main():
         
         selected_year = st.selectbox(
             "Año Fiscal", 
-            [2025, 2026, 2027], 
+            FISCAL_YEARS, 
             index=1,
             key="year_selector"
         )
         
         # Inicializar Gestor
-        manager = FinanceManager(selected_year)
+        try:
+            manager = get_manager(selected_year)
+        except StorageError as e:
+            st.error(f"❌ No se pudo abrir {selected_year}: {e}. No se ha modificado ningún fichero.")
+            st.stop()
+        for level, message in manager.pop_notices():
+            getattr(st, level)(message)
         
         st.divider()
         
@@ -681,7 +712,22 @@ def main():
             key="month_selector"
         )
         
-        manager.ensure_month_exists(selected_month)
+        # Los meses se guardan al modificarlos; aquí se pueden generar por lotes
+        with st.expander("🗓️ Generar meses"):
+            span_keys = [f"{y:04d}-{m:02d}" for y in FISCAL_YEARS for m in range(1, 13)]
+            col_from, col_to = st.columns(2)
+            span_from = col_from.selectbox("Desde", span_keys,
+                                           index=span_keys.index(f"{selected_year:04d}-01"), key="span_from")
+            span_to = col_to.selectbox("Hasta", span_keys,
+                                       index=span_keys.index(f"{selected_year:04d}-12"), key="span_to")
+            if st.button("Generar desde plantilla", use_container_width=True):
+                try:
+                    generated = get_store().generate_span(span_from, span_to)
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                else:
+                    count = sum(len(m) for m in generated.values())
+                    st.success(f"✅ {count} meses generados" if count else "Todos los meses ya existían")
         
         st.divider()
         
@@ -703,28 +749,47 @@ def main():
         
         # Acciones rápidas
         st.subheader("📦 Backup")
-        col_b1, col_b2 = st.columns(2)
+        render_backup(selected_year, selected_month)
+        
+        restore_key = f"restore_{st.session_state.get('restore_nonce', 0)}"
+        uploaded = st.file_uploader("📥 Restaurar", type=['json', 'gz'], label_visibility="collapsed",
+                                    key=restore_key)
+        # El fichero sigue en el selector en cada rerun: cada subida se restaura una sola vez
+        if uploaded and uploaded.file_id != st.session_state.get("restored_file_id"):
+            st.session_state.restored_file_id = uploaded.file_id
+            try:
+                data = decode_backup(uploaded.getvalue())
+                if data["year"] != selected_year:
+                    raise ValueError(f"la copia es de {data['year']}, no de {selected_year}")
+                manager.replace_data(data)
+            except (StorageError, ValueError) as e:
+                st.error(f"❌ Error: {e}")
+            else:
+                # Se vacía el selector
+                st.session_state.restore_nonce = st.session_state.get("restore_nonce", 0) + 1
+                st.toast("✅ Restaurado", icon="✅")
+                st.rerun()
         
-        with col_b1:
-            st.download_button(
-                "💾 Descargar",
-                data=json.dumps(manager.data, indent=2, ensure_ascii=False),
-                file_name=f"backup_{selected_year}_{selected_month:02d}.json",
-                mime="application/json",
-                use_container_width=True
-            )
+        st.divider()
         
-        with col_b2:
-            uploaded = st.file_uploader("📥 Restaurar", type=['json'], label_visibility="collapsed")
-            if uploaded:
-                try:
-                    data = json.load(uploaded)
-                    manager.data = data
-                    manager.save()
-                    st.success("✅ Restaurado")
-                    st.rerun()
-                except:
-                    st.error("❌ Error")
+        # Búsqueda en el registro de operaciones
+        with st.expander("📜 Registro de operaciones"):
+            log_query = st.text_input("Buscar", placeholder="Texto o acción...", key="log_query")
+            # Solo se leen los segmentos cuando hay algo que buscar
+            if log_query:
+                log_rows = get_oplog().search(text=log_query, limit=50)
+                if log_rows:
+                    st.dataframe(
+                        pd.DataFrame(log_rows)[["ts", "action", "detail"]],
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                else:
+                    st.caption("Sin resultados")
+
+        # Sondeo de cambios hechos por otras sesiones
+        st.session_state.seen_revision = (selected_year, manager.version)
+        watch_revision(selected_year)
 
     # --- Header Principal ---
     col_title, col_add_btn = st.columns([4, 1])
@@ -790,453 +855,64 @@ def main():
     
     st.divider()
     
-    # --- Pestañas Principales ---
-    tab_ops, tab_dash, tab_acc, tab_cat, tab_template = st.tabs([
-        "📝 Operaciones", 
-        "📊 Análisis", 
-        "💰 Cuentas", 
-        "📁 Categorías",
-        "⚙️ Plantilla"
-    ])
+    # --- Navegación: solo se calcula la vista seleccionada ---
+    view = st.segmented_control(
+        "Vista",
+        VIEWS,
+        default=VIEWS[0],
+        required=True,
+        key="view",
+        label_visibility="collapsed"
+    )
 
     # -----------------------
-    # TAB 1: OPERACIONES
+    # VISTA 1: OPERACIONES
     # -----------------------
-    with tab_ops:
+    if view == "📝 Operaciones":
         render_payment_manager(manager, selected_month, auto_deduct)
 
     # -----------------------
-    # TAB 2: ANÁLISIS VISUAL
+    # VISTA 2: ANÁLISIS VISUAL
     # -----------------------
-    with tab_dash:
-        df_items = manager.get_items_df(selected_month)
-        
-        if df_items.empty:
-            st.info("No hay datos para visualizar")
-        else:
-            # Gráficos mejorados
-            col_g1, col_g2 = st.columns(2)
-            
-            with col_g1:
-                st.subheader("📊 Distribución por Cuenta")
-                grp_acc = df_items.groupby("account_name")["amount"].sum().reset_index()
-                fig_pie = px.pie(
-                    grp_acc, 
-                    values="amount", 
-                    names="account_name",
-                    hole=0.5,
-                    color_discrete_sequence=px.colors.qualitative.Set3
-                )
-                fig_pie.update_traces(textposition='inside', textinfo='percent+label')
-                st.plotly_chart(fig_pie, use_container_width=True)
-            
-            with col_g2:
-                st.subheader("🏷️ Distribución por Categoría")
-                grp_cat = df_items.groupby("category")["amount"].sum().reset_index()
-                grp_cat = grp_cat.sort_values("amount", ascending=False).head(8)
-                fig_cat = px.bar(
-                    grp_cat,
-                    x="amount",
-                    y="category",
-                    orientation='h',
-                    color="amount",
-                    color_continuous_scale="Blues"
-                )
-                fig_cat.update_layout(showlegend=False)
-                st.plotly_chart(fig_cat, use_container_width=True)
-            
-            st.divider()
-            
-            # Timeline de pagos
-            st.subheader("📅 Timeline del Mes")
-            df_sorted = df_items.sort_values("due").copy()
-            df_sorted["acumulado"] = df_sorted["amount"].cumsum()
-            
-            fig_timeline = go.Figure()
-            
-            # Línea acumulada
-            fig_timeline.add_trace(go.Scatter(
-                x=df_sorted["due"],
-                y=df_sorted["acumulado"],
-                mode='lines+markers',
-                name='Acumulado',
-                line=dict(color='#1f77b4', width=3),
-                fill='tozeroy'
-            ))
-            
-            # Marcar pagados vs pendientes
-            paid_items = df_sorted[df_sorted["paid"]]
-            pending_items = df_sorted[~df_sorted["paid"]]
-            
-            fig_timeline.add_trace(go.Scatter(
-                x=paid_items["due"],
-                y=paid_items["amount"],
-                mode='markers',
-                name='Pagados',
-                marker=dict(size=12, color='green', symbol='circle')
-            ))
-            
-            fig_timeline.add_trace(go.Scatter(
-                x=pending_items["due"],
-                y=pending_items["amount"],
-                mode='markers',
-                name='Pendientes',
-                marker=dict(size=12, color='red', symbol='x')
-            ))
-            
-            fig_timeline.update_layout(
-                hovermode='x unified',
-                height=400
-            )
-            
-            st.plotly_chart(fig_timeline, use_container_width=True)
-            
-            # Comparativa Estado
-            st.divider()
-            st.subheader("✅ Estado de Pagos por Cuenta")
-            
-            status_data = []
-            for acc_name in df_items["account_name"].unique():
-                acc_items = df_items[df_items["account_name"] == acc_name]
-                pagados = acc_items[acc_items["paid"]]["amount"].sum()
-                pendientes = acc_items[~acc_items["paid"]]["amount"].sum()
-                
-                status_data.append({
-                    "Cuenta": acc_name,
-                    "Pagado": pagados,
-                    "Pendiente": pendientes
-                })
-            
-            df_status = pd.DataFrame(status_data)
-            
-            fig_status = go.Figure()
-            fig_status.add_trace(go.Bar(
-                name='Pagado',
-                x=df_status["Cuenta"],
-                y=df_status["Pagado"],
-                marker_color='#2ecc71'
-            ))
-            fig_status.add_trace(go.Bar(
-                name='Pendiente',
-                x=df_status["Cuenta"],
-                y=df_status["Pendiente"],
-                marker_color='#e74c3c'
-            ))
-            
-            fig_status.update_layout(barmode='stack', height=400)
-            st.plotly_chart(fig_status, use_container_width=True)
+    # Las vistas con gráficos se importan al dibujarse: plotly no se
+    # carga hasta que hace falta (ver views/__init__.py)
+    elif view == "📊 Análisis":
+        from views import analysis
+        analysis.render(manager, selected_month)
 
     # -----------------------
-    # TAB 3: CUENTAS
+    # VISTA 3: CUENTAS
     # -----------------------
-    with tab_acc:
-        st.subheader("🏦 Estado de Tesorería")
-        
-        df_items = manager.get_items_df(selected_month)
-        
-        # Calcular necesidades por cuenta
-        pending_by_acc = df_items[~df_items["paid"]].groupby("account_id")["amount"].sum().to_dict() if not df_items.empty else {}
-        
-        acc_data = []
-        total_gap = 0
-        total_balance = 0
-        total_pending = 0
-        
-        for acc in manager.data["accounts"]:
-            aid = str(acc["id"])
-            bal = float(manager.data["balances"].get(aid, 0.0))
-            need = pending_by_acc.get(acc["id"], 0.0)
-            gap = bal - need
-            
-            status = get_status_emoji(gap)
-            
-            if gap < 0:
-                total_gap += abs(gap)
-            
-            total_balance += bal
-            total_pending += need
-            
-            acc_data.append({
-                "": status,
-                "Cuenta": acc["name"],
-                "Saldo Actual": bal,
-                "Pendiente": need,
-                "Disponible": gap,
-            })
-        
-        df_accs = pd.DataFrame(acc_data)
-        
-        # Alertas globales
-        if total_gap > 0:
-            st.markdown(f"""
-            <div class="alert-card">
-                <h4>⚠️ Atención: Déficit Detectado</h4>
-                <p>Necesitas <strong>{eur(total_gap)}</strong> adicionales para cubrir todos los pagos pendientes.</p>
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            surplus = total_balance - total_pending
-            st.markdown(f"""
-            <div class="success-card">
-                <h4>🎉 ¡Fondos Suficientes!</h4>
-                <p>Todas las cuentas están cubiertas. Excedente: <strong>{eur(surplus)}</strong></p>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Tabla de cuentas
-        st.dataframe(
-            df_accs,
-            column_config={
-                "": st.column_config.TextColumn("", width="small"),
-                "Saldo Actual": st.column_config.ProgressColumn(
-                    "Saldo",
-                    format="%.2f €",
-                    min_value=0,
-                    max_value=df_accs["Saldo Actual"].max() if not df_accs.empty else 1000
-                ),
-                "Pendiente": st.column_config.NumberColumn(format="%.2f €"),
-                "Disponible": st.column_config.NumberColumn(
-                    format="%.2f €",
-                ),
-            },
-            hide_index=True,
-            use_container_width=True
-        )
-        
-        st.divider()
-        
-        # Gráfico de saldos
-        col_chart1, col_chart2 = st.columns(2)
-        
-        with col_chart1:
-            fig_bal = px.bar(
-                df_accs,
-                x="Cuenta",
-                y=["Saldo Actual", "Pendiente"],
-                title="Comparativa Saldo vs Necesidades",
-                barmode='group',
-                color_discrete_map={"Saldo Actual": "#2ecc71", "Pendiente": "#e74c3c"}
-            )
-            st.plotly_chart(fig_bal, use_container_width=True)
-        
-        with col_chart2:
-            # Disponible real
-            fig_disp = px.bar(
-                df_accs,
-                x="Cuenta",
-                y="Disponible",
-                title="Disponibilidad Real por Cuenta",
-                color="Disponible",
-                color_continuous_scale=["red", "yellow", "green"],
-                color_continuous_midpoint=0
-            )
-            st.plotly_chart(fig_disp, use_container_width=True)
-        
-        st.divider()
-        
-        # Ajuste manual de saldos
-        with st.expander("🛠️ Ajustar Saldos Manualmente"):
-            st.info("💡 Usa esto para sincronizar con tus saldos bancarios reales")
-            
-            with st.form("manual_balance"):
-                cols = st.columns(len(manager.data["accounts"]))
-                new_bals = {}
-                
-                for idx, acc in enumerate(manager.data["accounts"]):
-                    with cols[idx]:
-                        aid = str(acc["id"])
-                        current_bal = float(manager.data["balances"].get(aid, 0.0))
-                        val = st.number_input(
-                            f"{acc['name']}", 
-                            value=current_bal, 
-                            step=50.0,
-                            key=f"bal_{aid}"
-                        )
-                        new_bals[aid] = val
-                
-                if st.form_submit_button("💾 Actualizar Todos los Saldos", type="primary"):
-                    manager.data["balances"] = {k: round(v, 2) for k, v in new_bals.items()}
-                    manager.save()
-                    st.success("✅ Saldos actualizados correctamente")
-                    log_op("BALANCE_UPDATE", f"Saldos actualizados manualmente")
-                    st.rerun()
+    elif view == "💰 Cuentas":
+        from views import accounts
+        accounts.render(manager, selected_month)
 
     # -----------------------
-    # TAB 4: CATEGORÍAS
+    # VISTA 4: CATEGORÍAS
     # -----------------------
-    with tab_cat:
-        st.subheader("📁 Análisis por Categorías")
-        
-        summary = manager.get_category_summary(selected_month)
-        
-        if summary.empty:
-            st.info("No hay datos de categorías")
-        else:
-            # Métricas de categorías
-            col_m1, col_m2, col_m3 = st.columns(3)
-            
-            with col_m1:
-                st.metric("Categorías activas", len(summary))
-            
-            with col_m2:
-                top_cat = summary.iloc[0]
-                st.metric("Mayor gasto", top_cat["Categoría"], eur(top_cat["Total"]))
-            
-            with col_m3:
-                avg_per_cat = summary["Total"].mean()
-                st.metric("Promedio/Categoría", eur(avg_per_cat))
-            
-            st.divider()
-            
-            # Tabla detallada
-            st.dataframe(
-                summary,
-                column_config={
-                    "Total": st.column_config.ProgressColumn(
-                        "Total",
-                        format="%.2f €",
-                        min_value=0,
-                        max_value=summary["Total"].max()
-                    ),
-                    "Pagados": st.column_config.NumberColumn("Items Pagados"),
-                    "Pendientes": st.column_config.NumberColumn("Items Pendientes"),
-                },
-                hide_index=True,
-                use_container_width=True
-            )
-            
-            st.divider()
-            
-            # Treemap de categorías
-            st.subheader("🗺️ Mapa de Gastos por Categoría")
-            fig_tree = px.treemap(
-                summary,
-                path=['Categoría'],
-                values='Total',
-                color='Total',
-                color_continuous_scale='RdYlGn_r',
-                hover_data={'Total': ':,.2f'}
-            )
-            fig_tree.update_traces(textinfo="label+value+percent parent")
-            st.plotly_chart(fig_tree, use_container_width=True)
-            
-            # Gestión de categorías
-            st.divider()
-            with st.expander("⚙️ Gestionar Categorías"):
-                current_cats = manager.data.get("categories", [])
-                
-                col_cat1, col_cat2 = st.columns(2)
-                
-                with col_cat1:
-                    st.write("**Categorías Actuales:**")
-                    for cat in current_cats:
-                        st.write(f"• {cat}")
-                
-                with col_cat2:
-                    new_cat = st.text_input("Nueva Categoría")
-                    if st.button("➕ Agregar Categoría"):
-                        if new_cat and new_cat not in current_cats:
-                            manager.data["categories"].append(new_cat)
-                            manager.save()
-                            st.success(f"✅ Categoría '{new_cat}' agregada")
-                            st.rerun()
+    elif view == "📁 Categorías":
+        from views import categories
+        categories.render(manager, selected_month)
 
     # -----------------------
-    # TAB 5: PLANTILLA
+    # VISTA 5: TENDENCIAS (MULTI-AÑO)
     # -----------------------
-    with tab_template:
-        st.subheader("⚙️ Plantilla de Gastos Recurrentes")
-        st.info("💡 Los cambios aquí afectarán a los meses FUTUROS que generes, no al mes actual.")
-        
-        current_template = manager.data.get("template", [])
-        
-        if not current_template:
-            st.warning("No hay gastos recurrentes configurados")
-            df_template = pd.DataFrame(columns=[
-                "id", "name", "amount", "account_id", "category", 
-                "day", "type", "annual_month"
-            ])
-        else:
-            df_template = pd.DataFrame(current_template)
-        
-        edited_template = st.data_editor(
-            df_template,
-            num_rows="dynamic",
-            use_container_width=True,
-            key="template_editor",
-            column_config={
-                "id": st.column_config.NumberColumn("ID", disabled=True),
-                "name": st.column_config.TextColumn("Concepto", required=True),
-                "amount": st.column_config.NumberColumn("Importe (€)", format="%.2f", required=True),
-                "account_id": st.column_config.SelectboxColumn(
-                    "Cuenta ID",
-                    options=[a["id"] for a in manager.data["accounts"]],
-                    required=True
-                ),
-                "category": st.column_config.SelectboxColumn(
-                    "Categoría",
-                    options=manager.data.get("categories", ["Otros"])
-                ),
-                "day": st.column_config.NumberColumn(
-                    "Día del Mes",
-                    min_value=1,
-                    max_value=31,
-                    required=True
-                ),
-                "type": st.column_config.SelectboxColumn(
-                    "Tipo",
-                    options=["fixed", "sub_monthly", "sub_annual"],
-                    required=True
-                ),
-                "annual_month": st.column_config.NumberColumn(
-                    "Mes (Si Anual)",
-                    min_value=0,
-                    max_value=12,
-                    help="Solo para tipo 'sub_annual'. 0 = no aplica"
-                ),
-            }
-        )
-        
-        col_save, col_reset = st.columns([1, 1])
-        
-        with col_save:
-            if st.button("💾 Guardar Plantilla", type="primary", use_container_width=True):
-                new_tpl = edited_template.to_dict(orient="records")
-                
-                # Limpiar y validar
-                for item in new_tpl:
-                    if pd.isna(item.get("id")):
-                        item["id"] = manager.data["next_id"]
-                        manager.data["next_id"] += 1
-                    else:
-                        item["id"] = int(item["id"])
-                    
-                    item["account_id"] = int(item["account_id"])
-                    item["amount"] = float(item["amount"])
-                    item["day"] = int(item["day"])
-                    item["category"] = item.get("category", "Otros")
-                    item["annual_month"] = int(item.get("annual_month", 0))
-                
-                manager.data["template"] = new_tpl
-                manager.save()
-                st.success("✅ Plantilla actualizada correctamente")
-                log_op("TEMPLATE_UPDATE", f"{len(new_tpl)} items en plantilla")
-                st.rerun()
-        
-        with col_reset:
-            if st.button("🔄 Regenerar Mes Actual", use_container_width=True):
-                if st.session_state.get('confirm_regenerate'):
-                    # Eliminar mes actual y regenerar
-                    key = manager.get_month_key(selected_month)
-                    if key in manager.data["months"]:
-                        del manager.data["months"][key]
-                    manager.ensure_month_exists(selected_month)
-                    st.success("✅ Mes regenerado desde plantilla")
-                    st.session_state.confirm_regenerate = False
-                    st.rerun()
-                else:
-                    st.session_state.confirm_regenerate = True
-                    st.warning("⚠️ Esto eliminará todos los cambios del mes actual. Haz clic de nuevo para confirmar.")
+    elif view == "📈 Tendencias":
+        from views import trends
+        trends.render()
+
+    # -----------------------
+    # VISTA 6: PLANTILLA
+    # -----------------------
+    elif view == "⚙️ Plantilla":
+        render_template(manager, selected_month)
+
+    # Revisión ya pintada por esta sesión (incluye sus propios cambios)
+    st.session_state.seen_revision = (selected_year, manager.version)
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # También tras st.rerun()/st.stop(), que interrumpen main() con excepción
+        get_oplog().flush()
@@ -0,0 +1,116 @@
+"""Mide el coste de arranque de la app: importación y primer render.
+
+Cada muestra se toma en un proceso nuevo (importaciones en frío) sobre una
+copia temporal de los datos, así que la medida no modifica ./data. Para
+comparar antes/después, apunta --app-dir a otra copia del repositorio:
+
+    git worktree add /tmp/antes HEAD~1
+    python bench_startup.py --app-dir /tmp/antes
+    python bench_startup.py
+
+Uso:
+    python bench_startup.py [--app-dir DIR] [--data-dir DIR] [--runs N]
+"""
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+BASE_DIR = Path(__file__).resolve().parent
+# Módulos pesados cuya carga se quiere vigilar (streamlit ya importa el
+# paquete base de plotly para su tema; lo caro es plotly.express)
+HEAVY_MODULES = ["pandas", "plotly.express", "analytics"]
+
+# Importa app.py sin ejecutar main(): dependencias de nivel superior
+_IMPORT_PROBE = """
+import json, sys, time, warnings, logging
+warnings.filterwarnings("ignore")
+logging.disable(logging.WARNING)
+t0 = time.perf_counter()
+import streamlit
+t1 = time.perf_counter()
+import app
+t2 = time.perf_counter()
+print(json.dumps({"streamlit": t1 - t0, "app": t2 - t1,
+                  "loaded": [m for m in %(heavy)r if m in sys.modules]}))
+"""
+
+# Ejecuta el script completo con AppTest: importaciones + primer render
+_RENDER_PROBE = """
+import json, sys, time, warnings, logging
+warnings.filterwarnings("ignore")
+logging.disable(logging.WARNING)
+from streamlit.testing.v1 import AppTest
+t0 = time.perf_counter()
+import core
+core.set_data_dir(__import__("pathlib").Path(%(data_dir)r))
+at = AppTest.from_file(%(app_path)r, default_timeout=120)
+at.run()
+t1 = time.perf_counter()
+print(json.dumps({"render": t1 - t0, "exceptions": [str(e.value) for e in at.exception],
+                  "loaded": [m for m in %(heavy)r if m in sys.modules]}))
+"""
+
+
+def _probe(code: str, app_dir: Path) -> Dict:
+    result = subprocess.run([sys.executable, "-c", code], cwd=app_dir, capture_output=True,
+                            text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(app_dir: Path, data_dir: Path, runs: int) -> Dict[str, List]:
+    """Muestras de importación y primer render, cada una en un proceso nuevo"""
+    samples: Dict[str, List] = {"streamlit": [], "app": [], "render": [],
+                                "import_loaded": [], "render_loaded": []}
+    for _ in range(runs):
+        imported = _probe(_IMPORT_PROBE % {"heavy": HEAVY_MODULES}, app_dir)
+        samples["streamlit"].append(imported["streamlit"])
+        samples["app"].append(imported["app"])
+        samples["import_loaded"] = imported["loaded"]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            run_dir = Path(tmp) / "data"
+            if data_dir.exists():
+                shutil.copytree(data_dir, run_dir)
+            else:
+                run_dir.mkdir()
+            rendered = _probe(_RENDER_PROBE % {"heavy": HEAVY_MODULES, "data_dir": str(run_dir),
+                                               "app_path": str(app_dir / "app.py")}, app_dir)
+        if rendered["exceptions"]:
+            raise RuntimeError(f"La app falló en el primer render: {rendered['exceptions']}")
+        samples["render"].append(rendered["render"])
+        samples["render_loaded"] = rendered["loaded"]
+    return samples
+
+
+def _fmt(values: List[float]) -> str:
+    return f"{statistics.median(values) * 1000:8.0f} ms (mín {min(values) * 1000:.0f})"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", default=str(BASE_DIR), help="Copia del repositorio a medir")
+    parser.add_argument("--data-dir", help="Datos a copiar para cada muestra (por defecto APP_DIR/data)")
+    parser.add_argument("--runs", type=int, default=5, help="Muestras por medida (se usa la mediana)")
+    args = parser.parse_args()
+
+    app_dir = Path(args.app_dir).resolve()
+    data_dir = Path(args.data_dir) if args.data_dir else app_dir / "data"
+    samples = measure(app_dir, data_dir, args.runs)
+
+    print(f"{app_dir} ({args.runs} muestras, mediana)")
+    print(f"  import streamlit      {_fmt(samples['streamlit'])}")
+    print(f"  import app            {_fmt(samples['app'])}"
+          f"   cargados: {', '.join(samples['import_loaded']) or '-'}")
+    print(f"  primer render (total) {_fmt(samples['render'])}"
+          f"   cargados: {', '.join(samples['render_loaded']) or '-'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
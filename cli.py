@@ -0,0 +1,242 @@
+"""Utilidades de línea de comandos para los datos de accountcontrol.
+
+Trabaja sobre los mismos ficheros que la app a través de core.py, sin cargar
+Streamlit, plotly ni pandas, de modo que arranca al instante desde cron o scripts.
+
+Uso:
+    python cli.py [--data-dir DIR] migrate [--db FICHERO]
+    python cli.py [--data-dir DIR] convert {json,msgpack} [--year AÑO ...]
+    python cli.py [--data-dir DIR] generate DESDE [HASTA]
+    python cli.py [--data-dir DIR] mark-paid MES ITEM [ITEM ...] [--unpaid] [--no-deduct]
+    python cli.py [--data-dir DIR] add MES NOMBRE IMPORTE --day DÍA --account ID [--category C] [--notes N]
+    python cli.py [--data-dir DIR] export AÑO [HASTA] [--format {json,gzip,zip}] [--output FICHERO]
+    python cli.py [--data-dir DIR] balances AÑO [--set ID=IMPORTE ...]
+"""
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import core
+from storage import (BACKUP_SUFFIXES, SNAPSHOT_SUFFIXES, SQLITE_DB_NAME, StorageError,
+                     available_years, convert_snapshots, migrate_json_to_sqlite, month_span)
+
+DEFAULT_DATA_DIR = core.DATA_DIR
+
+
+class CommandError(Exception):
+    """Error de uso que se muestra sin traza y termina con código 1"""
+
+
+def _parse_month(value: str) -> Tuple[int, int]:
+    """"YYYY-MM" -> (año, mes)"""
+    try:
+        year, month = (int(part) for part in value.split("-"))
+    except ValueError:
+        raise CommandError(f"Mes inválido: {value} (formato YYYY-MM)") from None
+    if not 1 <= month <= 12:
+        raise CommandError(f"Mes inválido: {value}")
+    return year, month
+
+
+def _manager(year: int) -> core.FinanceManager:
+    """Gestor de un año que ya tiene datos (la CLI no crea años nuevos)"""
+    if year not in available_years(core.STORAGE_BACKEND, core.DATA_DIR):
+        raise CommandError(f"No hay datos de {year} en {core.DATA_DIR}")
+    return core.FinanceManager(year)
+
+
+def cmd_migrate(args: argparse.Namespace) -> int:
+    data_dir = Path(args.data_dir)
+    db_path = Path(args.db) if args.db else data_dir / SQLITE_DB_NAME
+    years = migrate_json_to_sqlite(data_dir, db_path)
+    if not years:
+        print(f"No se encontraron control_pagos_*.json en {data_dir}")
+        return 1
+    print(f"Migrados {len(years)} años a {db_path}: {', '.join(map(str, years))}")
+    print("Arranca la app con ACCOUNTCONTROL_STORAGE=sqlite para usar la base de datos.")
+    return 0
+
+
+def cmd_convert(args: argparse.Namespace) -> int:
+    data_dir = Path(args.data_dir)
+    try:
+        years = convert_snapshots(data_dir, args.format, args.year)
+    except ValueError as e:
+        print(e)
+        return 1
+    if not years:
+        print(f"No se encontraron instantáneas control_pagos_* en {data_dir}")
+        return 1
+    print(f"Convertidos {len(years)} años a {args.format}: {', '.join(map(str, years))}")
+    return 0
+
+
+def cmd_generate(args: argparse.Namespace) -> int:
+    # Todo el rango se valida antes de escribir nada; los años sin datos se
+    # crean desde la plantilla por defecto, igual que en la app
+    try:
+        span = month_span(args.start, args.end or args.start)
+    except ValueError as e:
+        raise CommandError(str(e)) from None
+    existing = set(available_years(core.STORAGE_BACKEND, core.DATA_DIR))
+    store = core.DataStore()
+    for year, months in span.items():
+        generated = store.manager(year).generate_months(months)
+        print(f"{year}: {len(generated)} meses generados"
+              + (f" ({', '.join(f'{m:02d}' for m in generated)})" if generated else "")
+              + ("" if year in existing else " [año nuevo]"))
+    return 0
+
+
+def cmd_mark_paid(args: argparse.Namespace) -> int:
+    year, month = _parse_month(args.month)
+    manager = _manager(year)
+    items = manager.month_data(month)["items"]
+    targets = []
+    for spec in args.items:
+        if spec.isdigit():
+            matches = [i for i in items if i["tid"] == int(spec)]
+        else:
+            matches = [i for i in items if i["name"].lower() == spec.lower()]
+        if not matches:
+            raise CommandError(f"No existe el item '{spec}' en {args.month}")
+        targets.extend(matches)
+    paid = not args.unpaid
+    with manager.transaction():
+        changed = [item for item in targets
+                   if manager.set_paid(month, item["tid"], paid, auto_deduct=not args.no_deduct)]
+    for item in changed:
+        print(f"{'✓' if paid else '✗'} {item['tid']} {item['name']} ({item['amount']:.2f} €)")
+    print(f"{len(changed)} items {'pagados' if paid else 'pendientes'}; "
+          f"{len(targets) - len(changed)} ya lo estaban")
+    return 0
+
+
+def cmd_add(args: argparse.Namespace) -> int:
+    year, month = _parse_month(args.month)
+    manager = _manager(year)
+    if args.account not in manager.get_accounts():
+        raise CommandError(f"Cuenta desconocida: {args.account}")
+    tid = manager.add_adhoc_expense(month, args.name, args.amount, args.day, args.account,
+                                    args.category, args.notes)
+    print(f"Añadido {tid}: {args.name} ({args.amount:.2f} €) en {args.month}")
+    return 0
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    last = args.last or args.year
+    years = [y for y in available_years(core.STORAGE_BACKEND, core.DATA_DIR) if args.year <= y <= last]
+    if not years:
+        span = args.year if last == args.year else f"{args.year}-{last}"
+        raise CommandError(f"No hay datos de {span} en {core.DATA_DIR}")
+    fmt = args.format or ("zip" if last != args.year else "json")
+    try:
+        payload = core.DataStore().backup(years, fmt)
+    except ValueError as e:
+        raise CommandError(str(e)) from None
+    if args.output:
+        Path(args.output).write_bytes(payload + b"\n" if fmt == "json" else payload)
+        print(f"Exportado {', '.join(map(str, years))} a {args.output}")
+    else:
+        sys.stdout.buffer.write(payload + b"\n" if fmt == "json" else payload)
+    return 0
+
+
+def cmd_balances(args: argparse.Namespace) -> int:
+    manager = _manager(args.year)
+    if args.set:
+        balances = dict(manager.data["balances"])
+        for assignment in args.set:
+            acc, sep, amount = assignment.partition("=")
+            try:
+                if not sep or int(acc) not in manager.get_accounts():
+                    raise ValueError
+                balances[str(int(acc))] = float(amount)
+            except ValueError:
+                raise CommandError(f"Asignación inválida: {assignment} (formato ID=IMPORTE)") from None
+        manager.set_balances(balances)
+    total = 0.0
+    for acc_id, name in manager.get_accounts().items():
+        balance = float(manager.data["balances"].get(str(acc_id), 0.0))
+        total += balance
+        print(f"{acc_id:>3}  {name:<30} {balance:>12.2f} €")
+    print(f"     {'Total':<30} {total:>12.2f} €")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="accountcontrol", description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default=str(DEFAULT_DATA_DIR),
+                        help="Directorio con los ficheros de datos (por defecto ./data)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_migrate = sub.add_parser("migrate", help="Copia los JSON existentes a SQLite")
+    p_migrate.add_argument("--db", help=f"Base de datos destino (por defecto DATA_DIR/{SQLITE_DB_NAME})")
+    p_migrate.set_defaults(func=cmd_migrate)
+
+    p_convert = sub.add_parser("convert", help="Reescribe las instantáneas en otro formato")
+    p_convert.add_argument("format", choices=list(SNAPSHOT_SUFFIXES),
+                           help="json (legible) o msgpack (binario, carga rápida)")
+    p_convert.add_argument("--year", type=int, action="append",
+                           help="Año a convertir (repetible; por defecto todos)")
+    p_convert.set_defaults(func=cmd_convert)
+
+    p_generate = sub.add_parser("generate", help="Genera meses desde la plantilla (una escritura por año; "
+                                "crea los años que aún no tienen datos)")
+    p_generate.add_argument("start", metavar="DESDE", help="Año (YYYY) o mes (YYYY-MM) inicial")
+    p_generate.add_argument("end", metavar="HASTA", nargs="?",
+                            help="Año o mes final, incluido (por defecto igual que DESDE)")
+    p_generate.set_defaults(func=cmd_generate)
+
+    p_paid = sub.add_parser("mark-paid", help="Marca items de un mes como pagados")
+    p_paid.add_argument("month", metavar="MES", help="Mes YYYY-MM")
+    p_paid.add_argument("items", metavar="ITEM", nargs="+", help="Id del item o nombre exacto")
+    p_paid.add_argument("--unpaid", action="store_true", help="Desmarcar en lugar de marcar")
+    p_paid.add_argument("--no-deduct", action="store_true",
+                        help="No descontar (ni devolver) el importe del saldo de la cuenta")
+    p_paid.set_defaults(func=cmd_mark_paid)
+
+    p_add = sub.add_parser("add", help="Añade un gasto puntual a un mes")
+    p_add.add_argument("month", metavar="MES", help="Mes YYYY-MM")
+    p_add.add_argument("name", metavar="NOMBRE")
+    p_add.add_argument("amount", metavar="IMPORTE", type=float)
+    p_add.add_argument("--day", type=int, required=True, help="Día de vencimiento")
+    p_add.add_argument("--account", type=int, required=True, help="Id de la cuenta")
+    p_add.add_argument("--category", default="Otros")
+    p_add.add_argument("--notes", default="")
+    p_add.set_defaults(func=cmd_add)
+
+    p_export = sub.add_parser("export", help="Exporta uno o varios años como copia de seguridad")
+    p_export.add_argument("year", metavar="AÑO", type=int)
+    p_export.add_argument("last", metavar="HASTA", type=int, nargs="?",
+                          help="Último año a exportar, incluido (por defecto igual que AÑO)")
+    p_export.add_argument("--format", choices=list(BACKUP_SUFFIXES),
+                          help="json (legible), gzip o zip (un JSON por año); "
+                               "por defecto json para un año y zip para un rango")
+    p_export.add_argument("--output", "-o", help="Fichero destino (por defecto la salida estándar)")
+    p_export.set_defaults(func=cmd_export)
+
+    p_balances = sub.add_parser("balances", help="Muestra (o fija) los saldos de las cuentas")
+    p_balances.add_argument("year", metavar="AÑO", type=int)
+    p_balances.add_argument("--set", action="append", metavar="ID=IMPORTE",
+                            help="Fija el saldo de una cuenta (repetible)")
+    p_balances.set_defaults(func=cmd_balances)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    core.set_data_dir(Path(args.data_dir))
+    try:
+        return args.func(args)
+    except (CommandError, StorageError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        core.get_oplog().flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,927 @@
+"""Lógica de negocio de accountcontrol, sin dependencias de interfaz.
+
+FinanceManager y DataStore se usan igual desde la app de Streamlit y desde
+la línea de comandos (cli.py). Este módulo no importa streamlit, plotly ni
+pandas: los métodos que devuelven DataFrames importan pandas al llamarse.
+"""
+from __future__ import annotations
+
+import calendar
+import functools
+import os
+import threading
+from contextlib import ExitStack, contextmanager
+from datetime import date
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Iterator, Iterable, Tuple
+
+from oplog import OperationLog
+from storage import (Item, Storage, StorageError, apply_op, encode_backup, expand_template,
+                     intern_items, item_columns, month_span, open_storage)
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# -----------------------
+# Configuración y Constantes
+# -----------------------
+BASE_DIR = Path(__file__).resolve().parent
+DATA_DIR = BASE_DIR / "data"
+LOG_FILE = DATA_DIR / "operaciones.jsonl"
+# Rotación del registro: por tamaño y al cambiar de mes (segmentos en .gz)
+LOG_MAX_BYTES = 1_000_000
+
+# Backend de persistencia: "json" (por defecto) o "sqlite" (data/accountcontrol.db)
+STORAGE_BACKEND = os.environ.get("ACCOUNTCONTROL_STORAGE", "json")
+
+# Diario de operaciones: cada cambio se añade como una línea JSON y se
+# compacta en control_pagos_{year}.json cada JOURNAL_COMPACT_EVERY entradas
+JOURNAL_MODE = True
+JOURNAL_COMPACT_EVERY = 200
+# Versiones anteriores de la instantánea que se conservan (.json.1, .json.2...)
+SNAPSHOT_GENERATIONS = 3
+# Formato de la instantánea en disco: "json" por defecto; con
+# ACCOUNTCONTROL_SNAPSHOT=msgpack (requiere el paquete msgpack) se escribe
+# además una instantánea binaria de carga rápida junto al JSON
+SNAPSHOT_FORMAT = os.environ.get("ACCOUNTCONTROL_SNAPSHOT", "json")
+# Tipos de gasto (los de plantilla más los puntuales), en orden de presentación
+TEMPLATE_TYPES = ["fixed", "sub_monthly", "sub_annual"]
+ITEM_TYPES = TEMPLATE_TYPES + ["adhoc"]
+
+# Agrupaciones de FinanceManager.summarize() -> columna del DataFrame de items
+SUMMARY_COLUMNS = {"category": "category", "account": "account_id", "month": "month"}
+
+# -----------------------
+# Registro de operaciones
+# -----------------------
+_oplog: Optional[OperationLog] = None
+_oplog_lock = threading.Lock()
+
+def set_data_dir(path: Path) -> None:
+    """Usa otro directorio de datos (y de registro) en este proceso"""
+    global DATA_DIR, LOG_FILE, _oplog
+    with _oplog_lock:
+        if _oplog is not None:
+            _oplog.flush()
+        DATA_DIR = Path(path)
+        LOG_FILE = DATA_DIR / "operaciones.jsonl"
+        _oplog = None
+
+def get_oplog() -> OperationLog:
+    """Registro de operaciones compartido por todo el proceso"""
+    global _oplog
+    with _oplog_lock:
+        if _oplog is None:
+            DATA_DIR.mkdir(exist_ok=True)
+            _oplog = OperationLog(LOG_FILE, max_bytes=LOG_MAX_BYTES)
+        return _oplog
+
+def log_op(action: str, detail: str) -> None:
+    """Registro de auditoría (en búfer hasta el final del rerun o del lote)"""
+    get_oplog().write(action, detail)
+
+def open_year_storage(year: int) -> Storage:
+    """Backend configurado (STORAGE_BACKEND, diario, generaciones...) para un año"""
+    DATA_DIR.mkdir(exist_ok=True)
+    return open_storage(STORAGE_BACKEND, DATA_DIR, year,
+                        journal=JOURNAL_MODE, compact_every=JOURNAL_COMPACT_EVERY,
+                        generations=SNAPSHOT_GENERATIONS, snapshot_format=SNAPSHOT_FORMAT)
+
+def _ordered_categorical(values: pd.Series, order: List[str]) -> pd.Categorical:
+    """Categórico con las categorías en `order` y, detrás, las no listadas"""
+    import pandas as pd
+    order = list(dict.fromkeys(order))
+    extra = sorted(set(values.dropna()) - set(order))
+    return pd.Categorical(values, categories=order + extra)
+
+# -----------------------
+# Lógica de Negocio (Clase Gestora)
+# -----------------------
+def _serialized(method):
+    """Ejecuta el método con el cerrojo del gestor tomado.
+
+    Un mismo FinanceManager lo comparten todas las sesiones (ver DataStore),
+    así que las mutaciones y las lecturas que recorren los datos no pueden
+    intercalarse entre hilos.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# Campos de un item que influyen en MonthTotals
+TOTALS_FIELDS = frozenset({"amount", "paid", "account_id", "category"})
+
+class Tally:
+    """Importe y número de items pagados y pendientes de un grupo"""
+    __slots__ = ("paid", "pending", "paid_count", "pending_count")
+
+    def __init__(self):
+        self.paid = 0.0
+        self.pending = 0.0
+        self.paid_count = 0
+        self.pending_count = 0
+
+    @property
+    def total(self) -> float:
+        return round(self.paid + self.pending, 2)
+
+    @property
+    def count(self) -> int:
+        return self.paid_count + self.pending_count
+
+    def copy(self) -> "Tally":
+        clone = Tally()
+        clone.paid, clone.pending = self.paid, self.pending
+        clone.paid_count, clone.pending_count = self.paid_count, self.pending_count
+        return clone
+
+class MonthTotals:
+    """Totales de un mes por cuenta y por categoría, separados en pagado/pendiente.
+
+    Se construyen una vez a partir de los items y luego cada alta, baja o
+    cambio suma o resta solo la aportación del item afectado (O(1)).
+    """
+    __slots__ = ("by_account", "by_category")
+
+    def __init__(self, items: Iterable[Any] = ()):
+        self.by_account: Dict[int, Tally] = {}
+        self.by_category: Dict[str, Tally] = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item: Any, sign: int = 1) -> None:
+        amount = sign * float(item.get("amount") or 0.0)
+        paid = bool(item.get("paid"))
+        for table, group in ((self.by_account, item.get("account_id")),
+                             (self.by_category, item.get("category") or "Otros")):
+            tally = table.get(group)
+            if tally is None:
+                tally = table[group] = Tally()
+            if paid:
+                tally.paid = round(tally.paid + amount, 2)
+                tally.paid_count += sign
+            else:
+                tally.pending = round(tally.pending + amount, 2)
+                tally.pending_count += sign
+
+    def remove(self, item: Any) -> None:
+        self.add(item, sign=-1)
+
+    def copy(self) -> "MonthTotals":
+        """Copia independiente (una Tally por grupo, no por item)"""
+        clone = MonthTotals()
+        clone.by_account = {k: t.copy() for k, t in self.by_account.items()}
+        clone.by_category = {k: t.copy() for k, t in self.by_category.items()}
+        return clone
+
+    def _sum(self, attr: str) -> Any:
+        return sum(getattr(t, attr) for t in self.by_account.values())
+
+    @property
+    def paid(self) -> float:
+        return round(self._sum("paid"), 2)
+
+    @property
+    def pending(self) -> float:
+        return round(self._sum("pending"), 2)
+
+    @property
+    def total(self) -> float:
+        return round(self.paid + self.pending, 2)
+
+    @property
+    def paid_count(self) -> int:
+        return self._sum("paid_count")
+
+    @property
+    def pending_count(self) -> int:
+        return self._sum("pending_count")
+
+    @property
+    def count(self) -> int:
+        return self.paid_count + self.pending_count
+
+class FinanceManager:
+    def __init__(self, year: int, storage: Optional[Storage] = None):
+        self.year = year
+        self.lock = threading.RLock()
+        self.storage = storage or open_year_storage(year)
+        # Operaciones aplicadas en memoria y aún no persistidas
+        self._pending: List[Dict[str, Any]] = []
+        # Contador de mutaciones: invalida las vistas cacheadas (get_items_df)
+        self.version = 0
+        self._df_cache: Dict[int, Tuple[int, pd.DataFrame]] = {}
+        # Totales por mes (clave "YYYY-MM"), mantenidos incrementalmente por _commit
+        self._totals: Dict[str, MonthTotals] = {}
+        # Estado de transacción (ver transaction())
+        self._tx_depth = 0
+        self._tx_dirty = False
+        # Avisos de carga (nivel, texto) pendientes de mostrar (ver pop_notices)
+        self.notices: List[Tuple[str, str]] = []
+        # Huella, revisión y next_id del disco vistos en la última carga/escritura
+        self._disk_stamp = None
+        self._base_rev = 0
+        self._base_next_id = 0
+        self.data = self._load_or_create()
+
+    def pop_notices(self) -> List[Tuple[str, str]]:
+        """Devuelve y descarta los avisos de carga (datos dañados o recuperados)"""
+        notices, self.notices = self.notices, []
+        return notices
+
+    def has_changed_on_disk(self) -> bool:
+        return self.storage.stamp() != self._disk_stamp
+
+    @_serialized
+    def reload_if_changed(self) -> bool:
+        """Recarga los datos solo si cambiaron en disco fuera de este proceso"""
+        if not self.has_changed_on_disk():
+            return False
+        data = self._load_or_create()
+        self._pending.clear()
+        self.data = data
+        self.version += 1
+        self._totals.clear()
+        return True
+
+    def _load_or_create(self) -> Dict[str, Any]:
+        """Carga el año; si no tiene ningún fichero, lo crea vacío.
+
+        Si hay ficheros pero no se pueden leer, StorageError se propaga sin
+        escribir nada: guardar aquí el año vacío borraría el diario y
+        desplazaría las copias que aún permiten recuperarlo.
+        """
+        with self.storage.locked():
+            data = self.storage.load()
+            self._mark_synced(data["next_id"] if data is not None else 0)
+        
+        if self.storage.recovered_from is not None:
+            self.notices.append(("warning", f"Datos recuperados de la copia {self.storage.recovered_from.name}: "
+                                            "el fichero principal estaba dañado."))
+        if self.storage.journal_set_aside is not None:
+            self.notices.append(("warning", f"El diario de cambios continuaba al fichero dañado y no se ha "
+                                            f"aplicado; se conserva en {self.storage.journal_set_aside.name}."))
+        
+        if data is None:
+            self.data = self._default_data()
+            self.save()
+            # save() puede haber incorporado datos creados entretanto por otra sesión
+            data = self.data
+        else:
+            # Los items se guardan en memoria como Item; los dicts quedan en disco
+            intern_items(data)
+        if self.storage.needs_compaction():
+            self.data = data
+            self.compact()
+        return data
+
+    def _default_data(self) -> Dict[str, Any]:
+        # Estructura inicial por defecto
+        return {
+            "year": self.year,
+            "control_day": 29,
+            "next_id": 1000,
+            "balances": {
+                "1": 0.0, "2": 0.0, "3": 0.0, "4": 0.0, "5": 0.0
+            },
+            "accounts": [
+                {"id": 1, "name": "BBVA – Ydaliz", "color": "#072146"},
+                {"id": 2, "name": "BBVA – Moisés", "color": "#072146"},
+                {"id": 3, "name": "Caixa – Conjunta", "color": "#0066b3"},
+                {"id": 4, "name": "Santander – Ydaliz", "color": "#ec0000"},
+                {"id": 5, "name": "Santander – Moisés", "color": "#ec0000"},
+            ],
+            "categories": [
+                "Vivienda", "Transporte", "Alimentación", "Suscripciones", 
+                "Seguros", "Educación", "Salud", "Ocio", "Otros"
+            ],
+            "template": [],
+            "months": {}
+        }
+
+    def _commit(self, op: Dict[str, Any]) -> None:
+        """Aplica una operación en memoria y la persiste (o la aplaza si hay transacción)"""
+        self._apply_tracking_totals(op)
+        self.version += 1
+        self._pending.append(op)
+        self._flush()
+
+    def _apply_tracking_totals(self, op: Dict[str, Any]) -> None:
+        """apply_op que además ajusta los totales del mes afectado.
+
+        Solo se restan y suman las aportaciones de los items tocados; un mes
+        regenerado se descarta y se recalcula al consultarlo.
+        """
+        kind = op["op"]
+        totals = self._totals.get(op.get("key"))
+        if kind == "month":
+            self._totals.pop(op["key"], None)
+        elif kind == "template":
+            # Los meses aún virtuales dependen de la plantilla
+            for key in [k for k in self._totals if k not in self.data["months"]]:
+                del self._totals[key]
+        if totals is None or kind not in ("add", "del", "set"):
+            apply_op(self.data, op, Item)
+            return
+        items = self.data["months"][op["key"]]["items"]
+        if kind == "add":
+            apply_op(self.data, op, Item)
+            totals.add(items[-1])
+        elif kind == "del":
+            tids = set(op["tids"])
+            for item in items:
+                if item["tid"] in tids:
+                    totals.remove(item)
+            apply_op(self.data, op, Item)
+        else:
+            item = None
+            if TOTALS_FIELDS.intersection(op["fields"]):
+                item = next((i for i in items if i["tid"] == op["tid"]), None)
+            if item is not None:
+                totals.remove(item)
+            apply_op(self.data, op, Item)
+            if item is not None:
+                totals.add(item)
+
+    @_serialized
+    def month_totals(self, month: int) -> "MonthTotals":
+        """Totales del mes por cuenta y categoría.
+
+        Se calculan una vez y después se actualizan en cada alta, baja o
+        cambio de estado. Se devuelve una copia hecha con el cerrojo tomado:
+        el gestor es compartido y otro hilo puede estar actualizando los
+        totales mientras quien llama los recorre.
+        """
+        key = self.get_month_key(month)
+        totals = self._totals.get(key)
+        if totals is None:
+            totals = self._totals[key] = MonthTotals(self.month_data(month)["items"])
+        return totals.copy()
+
+    @_serialized
+    def _flush(self) -> None:
+        if self._tx_depth or not self._pending:
+            return
+        with self.storage.locked():
+            self._sync_with_disk()
+            if self._pending:
+                self.storage.append(self.data, self._pending)
+            self._pending.clear()
+            self._mark_synced()
+        get_oplog().flush()
+        if self.storage.needs_compaction():
+            self.compact()
+
+    @_serialized
+    def save(self, force: bool = False):
+        """Escribe todos los datos (instantánea completa).
+
+        Salvo con force=True, los cambios hechos en disco por otra sesión se
+        incorporan antes de escribir en lugar de sobrescribirse.
+        """
+        if self._tx_depth:
+            # Dentro de una transacción: se escribe una sola vez al salir
+            self._tx_dirty = True
+            return
+        with self.storage.locked():
+            if not force:
+                self._sync_with_disk()
+            self.storage.write(self.data)
+            self._pending.clear()
+            self._mark_synced()
+
+    def _mark_synced(self, next_id: Optional[int] = None) -> None:
+        self._disk_stamp = self.storage.stamp()
+        self._base_rev = self.storage.revision
+        # Los ids desde aquí los reparte esta sesión (ver _rebase_ops)
+        self._base_next_id = self.data["next_id"] if next_id is None else next_id
+
+    def _sync_with_disk(self) -> None:
+        """Con el bloqueo tomado: incorpora lo escrito por otras sesiones.
+
+        Si la revisión en disco ya no es la que cargamos, se recarga el
+        estado más reciente y se reaplican encima las operaciones pendientes
+        de esta sesión, en vez de pisar los cambios ajenos.
+        """
+        if self.storage.stamp() == self._disk_stamp:
+            return
+        try:
+            latest = self.storage.load()
+        except StorageError:
+            return
+        if latest is None or self.storage.revision == self._base_rev:
+            return
+        disk_next_id = latest["next_id"]
+        self._pending = self._rebase_ops(intern_items(latest), self._pending, self._base_next_id)
+        self.data = latest
+        self.version += 1
+        self._totals.clear()
+        self._mark_synced(disk_next_id)
+        log_op("MERGE", f"{len(self._pending)} cambios reaplicados sobre la revisión {self.storage.revision}")
+
+    @staticmethod
+    def _rebase_ops(latest: Dict[str, Any], ops: List[Dict[str, Any]],
+                    base_next_id: int) -> List[Dict[str, Any]]:
+        """Reaplica operaciones sobre otra versión de los datos.
+
+        Los ids repartidos por esta sesión (desde base_next_id: gastos
+        añadidos y elementos nuevos de la plantilla) se renumeran si chocan
+        con los asignados por la otra sesión, y un mes que ya se generó en
+        disco se conserva.
+        """
+        remap: Dict[int, int] = {}
+        rebased = []
+        for op in ops:
+            op = {k: v for k, v in op.items() if k != "seq"}
+            kind = op["op"]
+            if kind == "month" and op["value"] is not None and op["key"] in latest["months"]:
+                continue
+            if kind == "add" and op["item"]["tid"] < latest["next_id"]:
+                new_tid = latest["next_id"]
+                remap[op["item"]["tid"]] = new_tid
+                op["item"] = dict(op["item"], tid=new_tid)
+                op["next_id"] = new_tid + 1
+            elif kind == "template":
+                next_id = max(latest["next_id"], op["next_id"])
+                items = []
+                for t in op["items"]:
+                    tid = int(t["id"])
+                    if base_next_id <= tid < latest["next_id"]:
+                        remap[tid] = next_id
+                        t = dict(t, id=next_id)
+                        next_id += 1
+                    items.append(t)
+                op["items"] = items
+                op["next_id"] = next_id
+            elif kind == "month" and op["value"] is not None and remap:
+                # Mes generado desde una plantilla con ids renumerados
+                op["value"] = dict(op["value"], items=[
+                    dict(i, tid=remap[i["tid"]]) if i["tid"] in remap else i
+                    for i in op["value"]["items"]])
+            elif kind == "set" and op["tid"] in remap:
+                op["tid"] = remap[op["tid"]]
+            elif kind == "del":
+                op["tids"] = [remap.get(t, t) for t in op["tids"]]
+            apply_op(latest, op, Item)
+            rebased.append(op)
+        return rebased
+
+    @_serialized
+    def compact(self):
+        """Pliega el diario de operaciones en la instantánea"""
+        self.save()
+        log_op("COMPACT", f"Diario de {self.year} compactado")
+
+    @contextmanager
+    def transaction(self) -> Iterator["FinanceManager"]:
+        """Agrupa varias operaciones en un único guardado.
+
+        Las operaciones del bloque se persisten juntas al salir. Si se produce
+        una excepción se restauran los datos en memoria y no se escribe nada.
+        Los bloques anidados se integran en la transacción exterior. El
+        cerrojo del gestor se mantiene durante todo el bloque.
+        """
+        with self.lock:
+            yield from self._transaction()
+
+    def _transaction(self) -> Iterator["FinanceManager"]:
+        if self._tx_depth == 0:
+            self._tx_dirty = False
+            tx_start = len(self._pending)
+            tx_version = self.version
+        self._tx_depth += 1
+        try:
+            yield self
+        except BaseException as exc:
+            self._tx_depth -= 1
+            if self._tx_depth == 0:
+                self._tx_dirty = False
+                if self.version != tx_version:
+                    self._rollback(tx_start, exc)
+            raise
+        self._tx_depth -= 1
+        if self._tx_depth == 0:
+            if self._tx_dirty:
+                self._tx_dirty = False
+                self.save()
+            else:
+                self._flush()
+
+    def _rollback(self, tx_start: int, cause: BaseException) -> None:
+        """Recarga el disco y reaplica las operaciones pendientes anteriores a la transacción"""
+        pending = self._pending[:tx_start]
+        base_next_id = self._base_next_id
+        self._pending = []
+        # Si la recarga falla, los datos en memoria quedan a medias: la siguiente
+        # reload_if_changed vuelve a intentarlo
+        self._disk_stamp = None
+        try:
+            self.data = self._load_or_create()
+        except StorageError as e:
+            raise StorageError(f"No se pudo deshacer la transacción: {e}") from cause
+        if pending:
+            self._pending = self._rebase_ops(self.data, pending, base_next_id)
+        self.version += 1
+        self._totals.clear()
+
+    def get_accounts(self) -> Dict[int, str]:
+        return {a["id"]: a["name"] for a in self.data["accounts"]}
+
+    def get_month_key(self, month: int) -> str:
+        return f"{self.year:04d}-{month:02d}"
+
+    def _build_month(self, month: int) -> Dict[str, Any]:
+        """Genera un mes desde la plantilla"""
+        return expand_template(self.data.get("template", []), self.year, [month])[month]
+
+    @_serialized
+    def generate_months(self, months: Optional[Iterable[int]] = None) -> List[int]:
+        """Guarda de una vez los meses indicados (por defecto todo el año).
+
+        Los meses ya guardados no se tocan. Todos se generan en una pasada
+        sobre la plantilla y se persisten con una única escritura. Devuelve
+        los meses generados.
+        """
+        months = list(range(1, 13)) if months is None else list(months)
+        missing = [m for m in dict.fromkeys(months) if not self.is_month_stored(m)]
+        if not missing:
+            return []
+        built = expand_template(self.data.get("template", []), self.year, missing)
+        with self.transaction():
+            for month in missing:
+                self._commit({"op": "month", "key": self.get_month_key(month), "value": built[month]})
+        log_op("GENERATE", f"{len(missing)} meses de {self.year} generados")
+        return missing
+
+    @_serialized
+    def ensure_month_exists(self, month: int):
+        """Guarda el mes a partir de la plantilla si aún era solo una vista.
+
+        Los meses no se guardan al consultarlos: mientras nadie los modifica
+        son vistas de la plantilla (ver month_data). Los métodos que cambian
+        items llaman aquí antes de su primera modificación.
+        """
+        key = self.get_month_key(month)
+        if key in self.data["months"]:
+            return
+
+        self._commit({"op": "month", "key": key, "value": self._build_month(month)})
+        log_op("NEW_MONTH", f"Mes {key} generado.")
+
+    def is_month_stored(self, month: int) -> bool:
+        return self.get_month_key(month) in self.data["months"]
+
+    def month_data(self, month: int) -> Dict[str, Any]:
+        """Mes guardado o, si nunca se ha modificado, vista virtual de la plantilla"""
+        stored = self.data["months"].get(self.get_month_key(month))
+        return stored if stored is not None else self._build_month(month)
+
+    @_serialized
+    def regenerate_month(self, month: int):
+        """Descarta los cambios del mes: vuelve a ser una vista de la plantilla"""
+        key = self.get_month_key(month)
+        if key not in self.data["months"]:
+            return
+        self._commit({"op": "month", "key": key, "value": None})
+        log_op("REGENERATE", f"Mes {key} regenerado desde plantilla")
+
+    @_serialized
+    def add_adhoc_expense(self, month: int, name: str, amount: float, day: int, 
+                         account_id: int, category: str = "Otros", notes: str = ""):
+        """Añade un gasto puntual solo a este mes y devuelve su id.
+
+        Fuera de una transacción, el id se asigna con el bloqueo del disco
+        tomado y tras incorporar los cambios de otras sesiones, y el bloqueo
+        se mantiene hasta guardar: nadie puede asignar el mismo id entretanto,
+        así que el devuelto es definitivo. Dentro de una transacción ajena el
+        id puede renumerarse al guardar si otra sesión escribió antes; las
+        operaciones del mismo bloque que lo usan se renumeran con él.
+        """
+        key = self.get_month_key(month)
+        with self.storage.locked():
+            if not self._tx_depth:
+                self._sync_with_disk()
+            with self.transaction():
+                self.ensure_month_exists(month)
+            
+                last_day = calendar.monthrange(self.year, month)[1]
+                day_safe = min(max(1, day), last_day)
+            
+                new_id = self.data["next_id"]
+            
+                item = {
+                    "tid": new_id,
+                    "name": name,
+                    "amount": round(float(amount), 2),
+                    "account_id": int(account_id),
+                    "category": category,
+                    "due": f"{self.year:04d}-{month:02d}-{day_safe:02d}",
+                    "paid": False,
+                    "paid_date": None,
+                    "type": "adhoc",
+                    "is_adhoc": True,
+                    "notes": notes
+                }
+            
+                self._commit({"op": "add", "key": key, "item": item, "next_id": new_id + 1})
+        log_op("ADD_ADHOC", f"{name} ({amount}€) añadido a {key}")
+        return new_id
+
+    def delete_item(self, month: int, tid: int):
+        """Elimina un item del mes"""
+        self.delete_items(month, [tid])
+
+    @_serialized
+    def delete_items(self, month: int, tids: List[int]):
+        """Elimina varios items del mes en una sola operación"""
+        key = self.get_month_key(month)
+        if not tids:
+            return
+        with self.transaction():
+            self.ensure_month_exists(month)
+            self._commit({"op": "del", "key": key, "tids": [int(t) for t in tids]})
+            log_op("DELETE", f"Items {', '.join(map(str, tids))} eliminados de {key}")
+
+    @_serialized
+    def update_item(self, month: int, tid: int, **fields):
+        """Actualiza solo los campos que cambian de un item del mes"""
+        key = self.get_month_key(month)
+        item = self.find_item(month, tid)
+        if item is None:
+            return
+        changed = {k: v for k, v in fields.items() if item.get(k) != v}
+        if changed:
+            with self.transaction():
+                self.ensure_month_exists(month)
+                self._commit({"op": "set", "key": key, "tid": int(tid), "fields": changed})
+
+    @_serialized
+    def set_paid(self, month: int, tid: int, paid: bool, auto_deduct: bool = False) -> bool:
+        """Marca/desmarca un item como pagado. Devuelve True si cambió."""
+        item = self.find_item(month, tid)
+        if item is None or bool(item["paid"]) == bool(paid):
+            return False
+        with self.transaction():
+            self.update_item(month, tid, paid=bool(paid),
+                             paid_date=str(date.today()) if paid else None)
+            if auto_deduct:
+                op = 'subtract' if paid else 'add'
+                self.update_balance(item["account_id"], item["amount"], op)
+        return True
+
+    @_serialized
+    def apply_item_changes(self, month: int, updates: Dict[int, Dict[str, Any]],
+                           balance_deltas: Optional[Dict[int, float]] = None):
+        """Aplica cambios de varios items y ajustes de saldo agregados por cuenta.
+
+        updates: {tid: {campo: valor}} con solo los campos modificados.
+        balance_deltas: {account_id: importe} a sumar a cada saldo.
+        Todo se persiste con una única escritura.
+        """
+        key = self.get_month_key(month)
+        with self.transaction():
+            if any(updates.values()):
+                self.ensure_month_exists(month)
+            for tid, fields in updates.items():
+                if fields:
+                    self._commit({"op": "set", "key": key, "tid": int(tid), "fields": fields})
+            for account_id, delta in (balance_deltas or {}).items():
+                if delta:
+                    self._commit({"op": "bal", "acc": str(account_id), "delta": float(delta)})
+
+    def find_item(self, month: int, tid: int) -> Optional[Dict[str, Any]]:
+        for item in self.month_data(month)["items"]:
+            if item["tid"] == tid:
+                return item
+        return None
+
+    @_serialized
+    def update_balance(self, account_id: int, amount: float, operation: str):
+        """operation: 'subtract' (pago) or 'add' (reembolso/ingreso)"""
+        delta = -float(amount) if operation == 'subtract' else float(amount)
+        self._commit({"op": "bal", "acc": str(account_id), "delta": delta})
+
+    @_serialized
+    def set_balances(self, balances: Dict[str, float]):
+        self._commit({"op": "balances", "values": {k: round(v, 2) for k, v in balances.items()}})
+
+    @_serialized
+    def set_template(self, template: List[Dict[str, Any]]):
+        """Sustituye la plantilla de gastos recurrentes.
+
+        Los meses sin modificar son vistas de la plantilla: antes de cambiarla
+        se guardan con la anterior los que ya han empezado, de modo que el
+        cambio solo alcanza al resto del año.
+        """
+        with self.transaction():
+            self.generate_months(self._started_months())
+            self._commit({"op": "template", "items": template, "next_id": self.data["next_id"]})
+
+    def _started_months(self) -> List[int]:
+        """Meses del año hasta el mes en curso, incluido"""
+        today = date.today()
+        if self.year != today.year:
+            return list(range(1, 13)) if self.year < today.year else []
+        return list(range(1, today.month + 1))
+
+    @_serialized
+    def allocate_id(self) -> int:
+        """Reserva un id nuevo (se persiste con la siguiente operación de plantilla)"""
+        new_id = self.data["next_id"]
+        self.data["next_id"] += 1
+        return new_id
+
+    @_serialized
+    def add_category(self, name: str):
+        self._commit({"op": "category", "name": name})
+
+    @_serialized
+    def replace_data(self, data: Dict[str, Any]):
+        """Sustituye todos los datos (restauración de backup)"""
+        self.data = intern_items(data)
+        self.version += 1
+        self._totals.clear()
+        self._pending.clear()
+        self.save(force=True)
+
+    @_serialized
+    def get_items_df(self, month: int) -> pd.DataFrame:
+        """Items del mes como DataFrame.
+
+        El resultado se cachea por mes hasta la siguiente mutación y se
+        comparte entre todas las vistas del rerun: no debe modificarse
+        in situ (usar .copy() antes de añadir o cambiar columnas).
+        """
+        cached = self._df_cache.get(month)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        df = self._build_items_df(month)
+        self._df_cache[month] = (self.version, df)
+        return df
+
+    def _build_items_df(self, month: int) -> pd.DataFrame:
+        import pandas as pd
+        items = self._month_items(month)
+        if not items:
+            return pd.DataFrame()
+
+        df = pd.DataFrame(item_columns(items))
+        # Categóricos con el orden de los datos: agrupar y filtrar usa códigos enteros
+        df["category"] = _ordered_categorical(df["category"], self.data.get("categories", []))
+        df["type"] = _ordered_categorical(df["type"], ITEM_TYPES)
+        accounts = self.data["accounts"]
+        df["account_name"] = _ordered_categorical(
+            df["account_id"].map(self.get_accounts()), [a["name"] for a in accounts])
+        
+        # Convertir fechas
+        df["due"] = pd.to_datetime(df["due"])
+        if "paid_date" in df.columns:
+            df["paid_date"] = pd.to_datetime(df["paid_date"], errors='coerce')
+        
+        return df.sort_values("due")
+    
+    def _month_items(self, month: int) -> List[Dict[str, Any]]:
+        """Items del mes: consulta indexada si el backend la ofrece"""
+        key = self.get_month_key(month)
+        if key not in self.data["months"]:
+            return self._build_month(month)["items"]
+        if not self._pending:
+            rows = self.storage.query_items(key)
+            if rows is not None:
+                return rows
+        return self.data["months"][key]["items"]
+
+    @_serialized
+    def summarize(self, months: Optional[Iterable[int]] = None, by: str = "category") -> pd.DataFrame:
+        """Totales agrupados en una sola pasada.
+
+        by: "category", "account" o "month". Devuelve una fila por grupo con
+        total, paid_count, pending_count, paid_amount y pending_amount
+        (más account_name si se agrupa por cuenta). Por defecto abarca
+        los doce meses del año; los que aún son vistas de la plantilla se
+        incluyen tal y como se ven.
+        """
+        import pandas as pd
+        if by not in SUMMARY_COLUMNS:
+            raise ValueError(f"Agrupación no soportada: {by}")
+        group_col = SUMMARY_COLUMNS[by]
+        columns = [group_col, "total", "paid_count", "pending_count", "paid_amount", "pending_amount"]
+        if months is None:
+            months = range(1, 13)
+        months = list(dict.fromkeys(months))
+        
+        rows = None
+        if not self._pending and months and all(self.is_month_stored(m) for m in months):
+            rows = self.storage.query_summary([self.get_month_key(m) for m in months], by)
+        if rows is not None:
+            summary = pd.DataFrame(rows, columns=["grp", *columns[1:]])
+            summary = summary.rename(columns={"grp": group_col})
+            if by == "month":
+                summary["month"] = summary["month"].str[5:].astype(int)
+        else:
+            frames = {m: self.get_items_df(m) for m in months}
+            frames = {m: f for m, f in frames.items() if not f.empty}
+            if not frames:
+                return pd.DataFrame(columns=columns)
+            df = pd.concat(frames, names=["month", None]).reset_index(level="month")
+            paid = df["paid"].astype(bool)
+            work = pd.DataFrame({
+                group_col: df[group_col],
+                "amount": df["amount"],
+                "paid": paid,
+                "paid_amount": df["amount"].where(paid, 0.0),
+            })
+            summary = work.groupby(group_col, observed=True).agg(
+                total=("amount", "sum"),
+                items=("amount", "size"),
+                paid_count=("paid", "sum"),
+                paid_amount=("paid_amount", "sum"),
+            ).reset_index()
+            summary["pending_count"] = summary.pop("items") - summary["paid_count"]
+            summary["pending_amount"] = summary["total"] - summary["paid_amount"]
+            summary = summary[columns]
+        
+        if by == "account":
+            summary.insert(1, "account_name", summary["account_id"].map(self.get_accounts()))
+        return summary
+    
+    def get_category_summary(self, month: int) -> pd.DataFrame:
+        """Resumen por categorías"""
+        import pandas as pd
+        summary = self.summarize([month], by="category")
+        if summary.empty:
+            return pd.DataFrame()
+        
+        summary = summary[["category", "total", "paid_count", "pending_count",
+                           "paid_amount", "pending_amount"]]
+        summary.columns = ["Categoría", "Total", "Pagados", "Pendientes",
+                           "Importe Pagado", "Importe Pendiente"]
+        return summary.sort_values("Total", ascending=False)
+
+    def get_upcoming_payments(self, days: int = 7) -> pd.DataFrame:
+        """Pagos próximos en los próximos N días"""
+        import pandas as pd
+        today = date.today()
+        month = today.month
+        df = self.get_items_df(month)
+        
+        if df.empty:
+            return pd.DataFrame()
+        
+        # Filtrar no pagados y próximos
+        df_pending = df[~df["paid"]].copy()
+        df_pending["days_until"] = (df_pending["due"] - pd.Timestamp(today)).dt.days
+        
+        upcoming = df_pending[df_pending["days_until"] <= days].copy()
+        return upcoming.sort_values("days_until")
+
+class DataStore:
+    """Almacén único del proceso con un FinanceManager autoritativo por año.
+
+    En la app todas las sesiones de Streamlit comparten los mismos gestores,
+    de modo que una modificación hecha en una sesión es visible en las demás
+    sin releer ficheros. La revisión de cada año (FinanceManager.version) crece con cada
+    cambio y permite a las sesiones saber, sin coste, si deben refrescar.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._managers: Dict[int, FinanceManager] = {}
+
+    def manager(self, year: int) -> FinanceManager:
+        """Gestor del año; solo se relee el disco si otro proceso lo modificó"""
+        with self._lock:
+            manager = self._managers.get(year)
+            if manager is None:
+                manager = FinanceManager(year)
+                self._managers[year] = manager
+                return manager
+        manager.reload_if_changed()
+        return manager
+
+    def revision(self, year: int) -> int:
+        """Revisión actual del año (0 si aún no se ha cargado)"""
+        manager = self._managers.get(year)
+        return manager.version if manager is not None else 0
+
+    def generate_span(self, start: str, end: str) -> Dict[int, List[int]]:
+        """Genera los meses entre dos claves "YYYY-MM" aunque abarquen varios años.
+
+        Devuelve {año: meses generados}; cada año se guarda con una escritura.
+        """
+        return {year: self.manager(year).generate_months(months)
+                for year, months in month_span(start, end).items()}
+
+    def backup(self, years: Iterable[int], fmt: str = "json") -> bytes:
+        """Copia de seguridad de los años indicados (ver storage.encode_backup).
+
+        Se serializa al llamarse y con los gestores bloqueados, así que refleja
+        un estado coherente aunque otra sesión esté guardando.
+        """
+        managers = [self.manager(year) for year in sorted(set(years))]
+        with ExitStack() as stack:
+            for manager in managers:
+                stack.enter_context(manager.lock)
+            return encode_backup({manager.year: manager.data for manager in managers}, fmt)
@@ -0,0 +1,101 @@
+"""Registro de operaciones en JSON-lines con búfer y rotación.
+
+Las entradas se acumulan en memoria y se escriben de una vez con flush()
+(una vez por rerun o por lote de cambios). El fichero activo rota por
+tamaño y por mes; los segmentos antiguos se comprimen con gzip.
+"""
+import gzip
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterator
+
+
+class OperationLog:
+    def __init__(self, path: Path, max_bytes: int = 1_000_000, rotate_monthly: bool = True,
+                 compress: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_monthly = rotate_monthly
+        self.compress = compress
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+
+    def write(self, action: str, detail: str, **extra: Any) -> None:
+        """Añade una entrada al búfer (no toca el disco)"""
+        record = {"ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "action": action, "detail": detail}
+        record.update(extra)
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._buffer.append(line)
+
+    def flush(self) -> None:
+        """Escribe el búfer en una sola operación de append"""
+        with self._lock:
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            self._rotate_if_needed()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+    def _rotate_if_needed(self) -> None:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return
+        started = datetime.fromtimestamp(stat.st_mtime)
+        now = datetime.now()
+        new_month = self.rotate_monthly and (started.year, started.month) != (now.year, now.month)
+        if stat.st_size < self.max_bytes and not new_month:
+            return
+        segment = self.path.with_name(f"{self.path.stem}-{now:%Y%m%d-%H%M%S-%f}{self.path.suffix}")
+        os.replace(self.path, segment)
+        if self.compress:
+            with open(segment, "rb") as src, gzip.open(f"{segment}.gz", "wb") as dst:
+                dst.writelines(src)
+            segment.unlink()
+
+    def segments(self) -> List[Path]:
+        """Ficheros del registro, del más reciente al más antiguo"""
+        rotated = sorted(self.path.parent.glob(f"{self.path.stem}-*{self.path.suffix}*"), reverse=True)
+        return ([self.path] if self.path.exists() else []) + rotated
+
+    def _read_lines(self, segment: Path) -> Iterator[str]:
+        opener = gzip.open if segment.suffix == ".gz" else open
+        with opener(segment, "rt", encoding="utf-8") as f:
+            yield from f
+
+    def search(self, text: Optional[str] = None, action: Optional[str] = None,
+               since: Optional[datetime] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Entradas más recientes que coinciden con el texto y/o la acción.
+
+        Los segmentos cuya última escritura es anterior a `since` no se abren.
+        """
+        self.flush()
+        needle = text.lower() if text else None
+        since_ts = since.strftime("%Y-%m-%d %H:%M:%S") if since else None
+        results: List[Dict[str, Any]] = []
+        for segment in self.segments():
+            if since and datetime.fromtimestamp(segment.stat().st_mtime) < since:
+                break
+            matches = []
+            for line in self._read_lines(segment):
+                # Filtro barato sobre el texto antes de parsear el JSON
+                if needle and needle not in line.lower():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if action and record.get("action") != action:
+                    continue
+                if since_ts and record.get("ts", "") < since_ts:
+                    continue
+                matches.append(record)
+            results.extend(reversed(matches))
+            if len(results) >= limit:
+                break
+        return results[:limit]
@@ -0,0 +1,1044 @@
+import calendar
+import copy
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Hashable, Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+try:
+    import msgpack
+except ImportError:  # Sin msgpack solo está disponible la instantánea JSON
+    msgpack = None
+
+# -----------------------
+# Modelo de items
+# -----------------------
+ITEM_COLUMNS = ["tid", "name", "amount", "account_id", "category", "due",
+                "paid", "paid_date", "type", "is_adhoc", "notes"]
+# Campos de texto muy repetidos entre items y meses: se internan
+_INTERNED_FIELDS = frozenset({"category", "due", "type"})
+
+
+class Item:
+    """Item de un mes con __slots__ en lugar de un dict por item.
+
+    Ocupa unas cuatro veces menos memoria y se usa como un dict (item["paid"],
+    item.get(), update(), iteración por claves), así que apply_op y los
+    backends lo tratan igual que a los dicts leídos del disco. Los campos
+    ausentes no se guardan; los desconocidos van a `_extra`. Al serializar se
+    convierte de nuevo en dict (ver json_default).
+    """
+
+    __slots__ = (*ITEM_COLUMNS, "_extra")
+    _FIELDS = frozenset(ITEM_COLUMNS)
+
+    def __init__(self, fields: Dict[str, Any]):
+        self._extra = None
+        for key, value in fields.items():
+            self[key] = value
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self._FIELDS:
+            if key in _INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key: object) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        for key in ITEM_COLUMNS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (Item, dict)):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Item({self.to_dict()!r})"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> List[str]:
+        return list(self)
+
+    def items(self) -> List[tuple]:
+        return [(key, self[key]) for key in self]
+
+    def update(self, fields: Dict[str, Any]) -> None:
+        for key, value in fields.items():
+            self[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: self[key] for key in self}
+
+
+def json_default(obj: Any) -> Any:
+    """`default` para json.dumps/msgpack: serializa los Item como dicts"""
+    if isinstance(obj, Item):
+        return obj.to_dict()
+    raise TypeError(f"Objeto no serializable: {type(obj).__name__}")
+
+
+def intern_items(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Convierte in situ los items de todos los meses en Item"""
+    for month in data["months"].values():
+        month["items"] = [i if isinstance(i, Item) else Item(i) for i in month["items"]]
+    return data
+
+
+def item_columns(items: Iterable[Any]) -> Dict[str, List[Any]]:
+    """Items (Item o dict) como columnas paralelas, listas para un DataFrame"""
+    columns: Dict[str, List[Any]] = {key: [] for key in ITEM_COLUMNS}
+    for item in items:
+        for key, values in columns.items():
+            values.append(item.get(key))
+    return columns
+
+
+# -----------------------
+# Generación de meses
+# -----------------------
+def expand_template(template: List[Dict[str, Any]], year: int,
+                    months: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """Genera varios meses de un año a partir de la plantilla.
+
+    Los campos de cada gasto se convierten una sola vez y los anuales
+    (sub_annual) se indexan por annual_month, de modo que cada mes solo
+    recorre los gastos que le corresponden. Devuelve {mes: datos del mes}.
+    """
+    regular, annual = [], {}
+    for pos, t in enumerate(template):
+        row = (pos, int(t["id"]), t["name"], float(t["amount"]), int(t["account_id"]),
+               t.get("category", "Otros"), t["type"], max(1, int(t.get("day", 1))))
+        if t.get("type") == "sub_annual":
+            annual.setdefault(int(t.get("annual_month", 0)), []).append(row)
+        else:
+            regular.append(row)
+    result = {}
+    for month in months:
+        last_day = calendar.monthrange(year, month)[1]
+        rows = regular
+        if month in annual:
+            rows = sorted(regular + annual[month])
+        prefix = f"{year:04d}-{month:02d}-"
+        items = [{
+            "tid": tid,
+            "name": name,
+            "amount": amount,
+            "account_id": account_id,
+            "category": category,
+            "due": f"{prefix}{min(day, last_day):02d}",
+            "paid": False,
+            "paid_date": None,
+            "type": kind,
+            "is_adhoc": False,
+            "notes": ""
+        } for _, tid, name, amount, account_id, category, kind, day in rows]
+        result[month] = {"year": year, "month": month, "items": items}
+    return result
+
+
+
+def year_months(data: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    """Los doce meses del año, guardados o no.
+
+    Los meses que nunca se han modificado no están en data["months"]: se
+    devuelve la vista de la plantilla, igual que FinanceManager.month_data.
+    """
+    stored = {int(month["month"]): month for month in data["months"].values()}
+    virtual = expand_template(data.get("template", []), int(data["year"]),
+                              [m for m in range(1, 13) if m not in stored])
+    return {m: stored.get(m) or virtual[m] for m in range(1, 13)}
+
+
+def month_span(start: str, end: str) -> Dict[int, List[int]]:
+    """Meses entre dos claves "YYYY-MM" (o años "YYYY") ambos incluidos, por año"""
+    def parse(value: str, last: bool) -> tuple:
+        year, _, month = value.partition("-")
+        return int(year), int(month) if month else (12 if last else 1)
+
+    (y0, m0), (y1, m1) = parse(start, False), parse(end, True)
+    if not (1 <= m0 <= 12 and 1 <= m1 <= 12) or (y0, m0) > (y1, m1):
+        raise ValueError(f"Rango de meses inválido: {start} - {end}")
+    span: Dict[int, List[int]] = {}
+    year, month = y0, m0
+    while (year, month) <= (y1, m1):
+        span.setdefault(year, []).append(month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return span
+
+
+# -----------------------
+# Modelo de operaciones
+# -----------------------
+def apply_op(data: Dict[str, Any], op: Dict[str, Any], item_factory=dict) -> None:
+    """Aplica una operación del diario sobre la estructura de datos.
+
+    Es la única vía de mutación de FinanceManager, de forma que el diario
+    puede reproducirse sobre la última instantánea al cargar. Los items
+    nuevos se crean con `item_factory` (dict, o Item en memoria).
+    """
+    kind = op["op"]
+    if kind == "month":
+        if op["value"] is None:
+            # El mes vuelve a ser una vista de la plantilla
+            data["months"].pop(op["key"], None)
+            return
+        month = dict(op["value"])
+        month["items"] = [item_factory(i) for i in op["value"]["items"]]
+        data["months"][op["key"]] = month
+    elif kind == "add":
+        data["months"][op["key"]]["items"].append(item_factory(op["item"]))
+        data["next_id"] = max(data["next_id"], op["next_id"])
+    elif kind == "del":
+        month = data["months"].get(op["key"])
+        if month is not None:
+            tids = set(op["tids"])
+            month["items"] = [i for i in month["items"] if i["tid"] not in tids]
+    elif kind == "set":
+        month = data["months"].get(op["key"])
+        if month is not None:
+            for item in month["items"]:
+                if item["tid"] == op["tid"]:
+                    item.update(op["fields"])
+                    break
+    elif kind == "bal":
+        acc = op["acc"]
+        current = float(data["balances"].get(acc, 0.0))
+        data["balances"][acc] = round(current + op["delta"], 2)
+    elif kind == "balances":
+        data["balances"] = dict(op["values"])
+    elif kind == "template":
+        data["template"] = copy.deepcopy(op["items"])
+        data["next_id"] = max(data["next_id"], op["next_id"])
+    elif kind == "category":
+        if op["name"] not in data["categories"]:
+            data["categories"].append(op["name"])
+    else:
+        raise ValueError(f"Operación desconocida en el diario: {kind}")
+
+
+class StorageError(Exception):
+    """Los datos persistidos no se pueden leer"""
+
+
+# Claves mínimas de un documento de año válido
+REQUIRED_KEYS = ("year", "next_id", "balances", "accounts", "template", "months")
+
+
+def check_integrity(data: Any) -> None:
+    """Comprobación rápida de estructura; lanza StorageError si falla"""
+    if not isinstance(data, dict):
+        raise StorageError("el documento no es un objeto JSON")
+    missing = [k for k in REQUIRED_KEYS if k not in data]
+    if missing:
+        raise StorageError(f"faltan claves: {', '.join(missing)}")
+    if not isinstance(data["months"], dict) or not isinstance(data["balances"], dict):
+        raise StorageError("months/balances con formato inválido")
+
+
+def atomic_write_bytes(path: Path, payload: bytes) -> None:
+    """Escribe en un temporal del mismo directorio, fsync y rename atómico"""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    _fsync_dir(path.parent)
+
+
+def _fsync_dir(directory: Path) -> None:
+    """Persiste la entrada de directorio tras un rename (no disponible en Windows)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# -----------------------
+# Formatos de instantánea
+# -----------------------
+# Extensión del fichero principal de cada formato
+SNAPSHOT_SUFFIXES = {"json": ".json", "msgpack": ".msgpack"}
+_MSGPACK_MAGIC = b"ACSNAP1\n"
+# Tipo de extensión msgpack que marca un campo ausente en un item
+_MISSING_EXT = 1
+_MISSING = object()
+
+
+def _to_columnar(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Guarda los items de cada mes por columnas: {campo: [valores...]}"""
+    missing = msgpack.ExtType(_MISSING_EXT, b"")
+    months = {}
+    for key, month in data["months"].items():
+        items = month.get("items", [])
+        names = list(dict.fromkeys(k for item in items for k in item))
+        columns = {name: [item.get(name, missing) for item in items] for name in names}
+        months[key] = dict(month, items={"rows": len(items), "columns": columns})
+    return dict(data, months=months)
+
+
+def _from_columnar(data: Dict[str, Any]) -> Dict[str, Any]:
+    for month in data["months"].values():
+        packed = month["items"]
+        names = list(packed["columns"])
+        rows = zip(*packed["columns"].values()) if names else [()] * packed["rows"]
+        month["items"] = [{k: v for k, v in zip(names, row) if v is not _MISSING} for row in rows]
+    return data
+
+
+def _msgpack_ext(code: int, payload: bytes) -> Any:
+    if code == _MISSING_EXT:
+        return _MISSING
+    return msgpack.ExtType(code, payload)
+
+
+def encode_snapshot(data: Dict[str, Any], fmt: str) -> bytes:
+    """Serializa el documento del año en el formato indicado"""
+    if fmt == "json":
+        return json.dumps(data, ensure_ascii=False, indent=2, default=json_default).encode("utf-8")
+    if fmt == "msgpack":
+        return _MSGPACK_MAGIC + msgpack.packb(_to_columnar(data), use_bin_type=True,
+                                              default=json_default)
+    raise ValueError(f"Formato de instantánea desconocido: {fmt}")
+
+
+def decode_snapshot(payload: bytes, fmt: str) -> Dict[str, Any]:
+    """Inverso de encode_snapshot; lanza StorageError si no se puede leer"""
+    try:
+        if fmt == "json":
+            data = json.loads(payload.decode("utf-8"))
+        else:
+            if not payload.startswith(_MSGPACK_MAGIC):
+                raise StorageError("cabecera desconocida")
+            data = _from_columnar(msgpack.unpackb(
+                payload[len(_MSGPACK_MAGIC):], raw=False, strict_map_key=False,
+                ext_hook=_msgpack_ext))
+    except StorageError:
+        raise
+    except Exception as e:
+        raise StorageError(str(e)) from e
+    check_integrity(data)
+    return data
+
+
+def _snapshot_format_of(path: Path) -> str:
+    """Formato de un fichero de instantánea (o de una de sus generaciones)"""
+    for fmt, suffix in SNAPSHOT_SUFFIXES.items():
+        if suffix in path.suffixes:
+            return fmt
+    return "json"
+
+
+# -----------------------
+# Copias de seguridad
+# -----------------------
+# Extensión del fichero descargado en cada formato
+BACKUP_SUFFIXES = {"json": ".json", "gzip": ".json.gz", "zip": ".zip"}
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def encode_backup(datasets: Dict[int, Dict[str, Any]], fmt: str) -> bytes:
+    """Copia de seguridad de uno o varios años ({año: documento}).
+
+    json y gzip contienen el documento de un único año, el mismo que acepta
+    la restauración; zip guarda un control_pagos_{año}.json por año.
+    """
+    if fmt not in BACKUP_SUFFIXES:
+        raise ValueError(f"Formato de copia desconocido: {fmt}")
+    if fmt != "zip" and len(datasets) != 1:
+        raise ValueError("Solo el formato zip admite varios años")
+    if fmt == "zip":
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for year, data in sorted(datasets.items()):
+                archive.writestr(f"control_pagos_{year}.json", encode_snapshot(data, "json"))
+        return buffer.getvalue()
+    payload = encode_snapshot(next(iter(datasets.values())), "json")
+    return gzip.compress(payload) if fmt == "gzip" else payload
+
+
+def decode_backup(payload: bytes) -> Dict[str, Any]:
+    """Documento de un año desde una copia json o gzip; lanza StorageError si no es válida"""
+    if payload.startswith(_GZIP_MAGIC):
+        try:
+            payload = gzip.decompress(payload)
+        except (OSError, EOFError) as e:
+            raise StorageError(str(e)) from e
+    return decode_snapshot(payload, "json")
+
+
+# -----------------------
+# Interfaz de almacenamiento
+# -----------------------
+class Storage:
+    """Persistencia de los datos de un año.
+
+    FinanceManager mantiene los datos en memoria y delega aquí la lectura
+    inicial, la escritura de operaciones (append) y la escritura completa
+    (write). Los backends con índices pueden además responder consultas.
+    """
+
+    # Fichero de respaldo del que se recuperó la última carga (si no fue el principal)
+    recovered_from: Optional[Path] = None
+    # Diario que la última carga apartó sin aplicar porque no continúa a la copia recuperada
+    journal_set_aside: Optional[Path] = None
+
+    def __init__(self, lock_path: Path):
+        self.lock_path = lock_path
+        # Revisión del documento en disco según la última carga/escritura
+        self.revision = 0
+        self._lock_guard = threading.RLock()
+        self._lock_depth = 0
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Bloqueo exclusivo (fcntl) para leer-modificar-escribir; reentrante"""
+        with self._lock_guard:
+            if self._lock_depth or fcntl is None:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self.lock_path, "a+") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def stamp(self) -> Hashable:
+        """Valor barato que cambia cuando los datos cambian en disco"""
+        raise NotImplementedError
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Datos completos del año, o None si todavía no existen.
+
+        Lanza StorageError si los datos existen pero no se pueden leer.
+        """
+        raise NotImplementedError
+
+    def append(self, data: Dict[str, Any], ops: List[Dict[str, Any]]) -> None:
+        """Persiste operaciones ya aplicadas sobre `data`"""
+        raise NotImplementedError
+
+    def write(self, data: Dict[str, Any]) -> None:
+        """Reescribe todos los datos del año"""
+        raise NotImplementedError
+
+    def needs_compaction(self) -> bool:
+        return False
+
+    def query_items(self, month_key: str) -> Optional[List[Dict[str, Any]]]:
+        """Items del mes ordenados por vencimiento (None si no está soportado)"""
+        return None
+
+    def query_summary(self, month_keys: Iterable[str], by: str) -> Optional[List[Dict[str, Any]]]:
+        """Totales agrupados por `by` (None si no está soportado)"""
+        return None
+
+
+class JsonStorage(Storage):
+    """Instantánea control_pagos_{year}.json más diario JSON-lines opcional.
+
+    La instantánea se escribe de forma atómica y se conservan las
+    `generations` versiones anteriores (control_pagos_{year}.json.1, .2...).
+    Con snapshot_format="msgpack" se escribe además control_pagos_{year}.msgpack
+    (items por columnas, mucho más rápida de cargar) junto al JSON legible.
+
+    Al cargar se usa siempre el fichero principal más reciente: el diario
+    continúa a ese fichero, así que si no se puede leer (corrupto, o msgpack
+    sin el paquete instalado) nunca se recurre a un principal más antiguo.
+    Si ninguna generación es válida, load() lanza StorageError y los
+    ficheros quedan como estaban.
+    """
+
+    def __init__(self, file_path: Path, journal_path: Path, journal: bool = True,
+                 compact_every: int = 200, generations: int = 3,
+                 snapshot_format: str = "json"):
+        if snapshot_format not in SNAPSHOT_SUFFIXES:
+            raise ValueError(f"Formato de instantánea desconocido: {snapshot_format}")
+        if snapshot_format == "msgpack" and msgpack is None:
+            raise ValueError("El formato msgpack requiere el paquete msgpack")
+        super().__init__(file_path.with_suffix(".lock"))
+        self.snapshot_format = snapshot_format
+        # Fichero principal de cada formato, esté o no instalado msgpack: uno
+        # más reciente que no se puede leer debe detectarse, no ignorarse
+        self.snapshot_paths = {fmt: file_path.with_suffix(suffix)
+                               for fmt, suffix in SNAPSHOT_SUFFIXES.items()}
+        file_path = self.snapshot_paths[snapshot_format]
+        self.file_path = file_path
+        self.journal_path = journal_path
+        self.journal = journal
+        self.compact_every = compact_every
+        self.generations = generations
+        self._journal_records = 0
+
+    def stamp(self) -> Hashable:
+        """(mtime_ns, tamaño) de las instantáneas y del diario (None si no existen)"""
+        stamps = []
+        for path in (*self.snapshot_paths.values(), self.journal_path):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                stamps.append(None)
+            else:
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamps)
+
+    def generation_path(self, n: int) -> Path:
+        return self.file_path.with_name(f"{self.file_path.name}.{n}")
+
+    def _candidates(self) -> List[Path]:
+        """Fichero principal más reciente y, si es del formato configurado, sus generaciones.
+
+        Un principal más antiguo de otro formato nunca es candidato: aplicarle
+        el diario, que continúa al más reciente, perdería los cambios intermedios.
+        """
+        mains = []
+        for path in self.snapshot_paths.values():
+            try:
+                mains.append((path.stat().st_mtime_ns, path))
+            except FileNotFoundError:
+                pass
+        newest = max(mains)[1] if mains else None
+        if newest is not None and newest != self.file_path:
+            return [newest]
+        generations = [self.generation_path(n) for n in range(1, self.generations + 1)]
+        return ([newest] if newest else []) + [p for p in generations if p.exists()]
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Carga la generación válida más reciente y le aplica el diario"""
+        # Con el bloqueo tomado: recuperar una copia puede apartar el diario
+        with self.locked():
+            return self._load()
+
+    def _load(self) -> Optional[Dict[str, Any]]:
+        self.revision = 0
+        self._journal_records = 0
+        self.recovered_from = None
+        self.journal_set_aside = None
+        candidates = self._candidates()
+        if not candidates:
+            return None
+        mains = set(self.snapshot_paths.values())
+        errors = []
+        for path in candidates:
+            fmt = _snapshot_format_of(path)
+            if fmt == "msgpack" and msgpack is None:
+                raise StorageError(f"{path.name} es la instantánea más reciente pero msgpack no está "
+                                   f"instalado; instálalo para leerla (y `cli.py convert json` "
+                                   f"para volver a JSON)")
+            try:
+                data = decode_snapshot(path.read_bytes(), fmt)
+            except StorageError as e:
+                errors.append(f"{path.name}: {e}")
+                continue
+            if path not in mains:
+                self.recovered_from = path
+            self.revision = int(data.pop("journal_seq", data.get("rev", 0)))
+            data["rev"] = self.revision
+            self._replay(data)
+            return data
+        # Sin escribir nada: las copias dañadas y el diario se conservan para recuperarlos a mano
+        raise StorageError(f"Ninguna copia de {self.file_path} se puede leer ({'; '.join(errors)})")
+
+    def _replay(self, data: Dict[str, Any]) -> None:
+        """Reaplica las entradas del diario posteriores a la instantánea.
+
+        Una última línea incompleta (escritura interrumpida) se descarta. Si
+        el diario empieza después de la revisión cargada (continúa a una
+        instantánea perdida), se aparta sin aplicarlo; si alguna entrada no
+        encaja en los datos se lanza StorageError.
+        """
+        if not self.journal_path.exists():
+            return
+        ops = []
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    ops.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        if ops and ops[0]["seq"] - 1 > self.revision:
+            self.journal_set_aside = self.journal_path.with_name(
+                f"{self.journal_path.name}.apartado-{ops[0]['seq']}")
+            os.replace(self.journal_path, self.journal_set_aside)
+            return
+        self._journal_records = len(ops)
+        for op in ops:
+            if op["seq"] <= self.revision:
+                continue
+            try:
+                apply_op(data, op)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                raise StorageError(f"El diario {self.journal_path.name} no encaja en la revisión "
+                                   f"{self.revision} (entrada {op['seq']}: {e!r})") from e
+            self.revision = op["seq"]
+        data["rev"] = self.revision
+
+    def append(self, data: Dict[str, Any], ops: List[Dict[str, Any]]) -> None:
+        if not self.journal:
+            self.write(data)
+            return
+        if not ops:
+            return
+        lines = []
+        for op in ops:
+            self.revision += 1
+            op["seq"] = self.revision
+            lines.append(json.dumps(op, ensure_ascii=False, separators=(",", ":"), default=json_default))
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_records += len(lines)
+        data["rev"] = self.revision
+
+    def write(self, data: Dict[str, Any]) -> None:
+        self.revision += 1
+        data["rev"] = self.revision
+        payload = encode_snapshot(data, self.snapshot_format)
+        self._rotate_generations()
+        if self.snapshot_format != "json":
+            # El JSON legible se escribe antes: el binario queda como el más reciente
+            atomic_write_bytes(self.snapshot_paths["json"], encode_snapshot(data, "json"))
+        atomic_write_bytes(self.file_path, payload)
+        if self.journal_path.exists():
+            self.journal_path.unlink()
+        self._journal_records = 0
+
+    def _rotate_generations(self) -> None:
+        """Desplaza .1 -> .2 ... y conserva la instantánea actual como .1"""
+        if self.generations <= 0 or not self.file_path.exists():
+            return
+        for n in range(self.generations - 1, 0, -1):
+            src = self.generation_path(n)
+            if src.exists():
+                os.replace(src, self.generation_path(n + 1))
+        first = self.generation_path(1)
+        try:
+            # Enlace duro: el fichero principal nunca deja de existir
+            os.link(self.file_path, first)
+        except OSError:
+            shutil.copy2(self.file_path, first)
+
+    def needs_compaction(self) -> bool:
+        return self.journal and self._journal_records >= self.compact_every
+
+
+# -----------------------
+# Backend SQLite
+# -----------------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS years (
+    year INTEGER PRIMARY KEY,
+    control_day INTEGER NOT NULL,
+    next_id INTEGER NOT NULL,
+    rev INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    year INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    color TEXT,
+    PRIMARY KEY (year, id)
+);
+CREATE TABLE IF NOT EXISTS categories (
+    year INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (year, name)
+);
+CREATE TABLE IF NOT EXISTS balances (
+    year INTEGER NOT NULL,
+    account_id TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (year, account_id)
+);
+CREATE TABLE IF NOT EXISTS template (
+    year INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    amount REAL NOT NULL,
+    account_id INTEGER NOT NULL,
+    category TEXT,
+    day INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    annual_month INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (year, id)
+);
+CREATE TABLE IF NOT EXISTS months (
+    year INTEGER NOT NULL,
+    month_key TEXT PRIMARY KEY,
+    month INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    month_key TEXT NOT NULL,
+    tid INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    amount REAL NOT NULL,
+    account_id INTEGER NOT NULL,
+    category TEXT,
+    due TEXT NOT NULL,
+    paid INTEGER NOT NULL DEFAULT 0,
+    paid_date TEXT,
+    type TEXT,
+    is_adhoc INTEGER NOT NULL DEFAULT 0,
+    notes TEXT,
+    PRIMARY KEY (month_key, tid)
+);
+CREATE INDEX IF NOT EXISTS idx_items_month_due ON items (month_key, due);
+CREATE INDEX IF NOT EXISTS idx_items_account_paid ON items (account_id, paid);
+CREATE INDEX IF NOT EXISTS idx_items_category ON items (category);
+"""
+
+TEMPLATE_COLUMNS = ["id", "name", "amount", "account_id", "category", "day",
+                    "type", "annual_month"]
+SUMMARY_GROUPS = {"category": "category", "account": "account_id", "month": "month_key"}
+
+
+def _item_row(month_key: str, item: Dict[str, Any]) -> tuple:
+    return (month_key, int(item["tid"]), item["name"], float(item["amount"]),
+            int(item["account_id"]), item.get("category"), str(item["due"])[:10],
+            int(bool(item.get("paid"))), item.get("paid_date"), item.get("type"),
+            int(bool(item.get("is_adhoc"))), item.get("notes"))
+
+
+def _item_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+    item = dict(zip(ITEM_COLUMNS, tuple(row)))
+    item["paid"] = bool(item["paid"])
+    item["is_adhoc"] = bool(item["is_adhoc"])
+    return item
+
+
+class SqliteStorage(Storage):
+    """Tablas normalizadas en data/accountcontrol.db (todos los años en un fichero).
+
+    Cada operación se traduce a sentencias puntuales (un pago marcado es un
+    UPDATE de una fila) y las vistas por mes se resuelven con índices.
+    """
+
+    def __init__(self, db_path: Path, year: int):
+        super().__init__(db_path.with_name(f"{db_path.name}.lock"))
+        self.db_path = db_path
+        self.year = year
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SQLITE_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Conexión de corta duración: confirma al salir o deshace si hay error"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def stamp(self) -> Hashable:
+        with self._connect() as conn:
+            row = conn.execute("SELECT rev FROM years WHERE year = ?", (self.year,)).fetchone()
+        return row["rev"] if row else None
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        y = (self.year,)
+        with self._connect() as conn:
+            meta = conn.execute("SELECT * FROM years WHERE year = ?", y).fetchone()
+            if meta is None:
+                return None
+            accounts = conn.execute(
+                "SELECT id, name, color FROM accounts WHERE year = ? ORDER BY position", y)
+            categories = conn.execute(
+                "SELECT name FROM categories WHERE year = ? ORDER BY position", y)
+            balances = conn.execute(
+                "SELECT account_id, amount FROM balances WHERE year = ?", y)
+            template = conn.execute(
+                f"SELECT {', '.join(TEMPLATE_COLUMNS)} FROM template WHERE year = ? ORDER BY position", y)
+            self.revision = meta["rev"]
+            data = {
+                "year": self.year,
+                "rev": meta["rev"],
+                "control_day": meta["control_day"],
+                "next_id": meta["next_id"],
+                "balances": {r["account_id"]: r["amount"] for r in balances},
+                "accounts": [dict(r) for r in accounts],
+                "categories": [r["name"] for r in categories],
+                "template": [dict(r) for r in template],
+                "months": {},
+            }
+            for r in conn.execute("SELECT month_key, month FROM months WHERE year = ? ORDER BY month_key", y):
+                data["months"][r["month_key"]] = {"year": self.year, "month": r["month"], "items": []}
+            rows = conn.execute(
+                f"SELECT i.{', i.'.join(ITEM_COLUMNS)}, i.month_key AS _key FROM items i "
+                "JOIN months m ON m.month_key = i.month_key WHERE m.year = ? ORDER BY i.rowid", y)
+            for r in rows:
+                data["months"][r["_key"]]["items"].append(_item_from_row(r[:-1]))
+        return data
+
+    def write(self, data: Dict[str, Any]) -> None:
+        y = self.year
+        with self._connect() as conn:
+            conn.execute("DELETE FROM items WHERE month_key IN (SELECT month_key FROM months WHERE year = ?)", (y,))
+            for table in ("months", "accounts", "categories", "balances", "template"):
+                conn.execute(f"DELETE FROM {table} WHERE year = ?", (y,))
+            conn.execute(
+                "INSERT INTO years (year, control_day, next_id) VALUES (?, ?, ?) "
+                "ON CONFLICT(year) DO UPDATE SET control_day = excluded.control_day, "
+                "next_id = excluded.next_id",
+                (y, int(data.get("control_day", 29)), int(data["next_id"])))
+            conn.executemany(
+                "INSERT INTO accounts (year, id, position, name, color) VALUES (?, ?, ?, ?, ?)",
+                [(y, int(a["id"]), pos, a["name"], a.get("color")) for pos, a in enumerate(data["accounts"])])
+            conn.executemany(
+                "INSERT INTO categories (year, position, name) VALUES (?, ?, ?)",
+                [(y, pos, name) for pos, name in enumerate(data.get("categories", []))])
+            conn.executemany(
+                "INSERT INTO balances (year, account_id, amount) VALUES (?, ?, ?)",
+                [(y, str(k), float(v)) for k, v in data["balances"].items()])
+            self._insert_template(conn, data.get("template", []))
+            for key, month in data["months"].items():
+                self._insert_month(conn, key, month)
+            self._bump_rev(conn)
+        data["rev"] = self.revision
+
+    def append(self, data: Dict[str, Any], ops: List[Dict[str, Any]]) -> None:
+        y = self.year
+        with self._connect() as conn:
+            for op in ops:
+                kind = op["op"]
+                if kind == "month":
+                    conn.execute("DELETE FROM items WHERE month_key = ?", (op["key"],))
+                    conn.execute("DELETE FROM months WHERE month_key = ?", (op["key"],))
+                    if op["value"] is not None:
+                        self._insert_month(conn, op["key"], op["value"])
+                elif kind == "add":
+                    conn.execute(f"INSERT INTO items VALUES ({', '.join('?' * 12)})",
+                                 _item_row(op["key"], op["item"]))
+                    conn.execute("UPDATE years SET next_id = MAX(next_id, ?) WHERE year = ?", (op["next_id"], y))
+                elif kind == "del":
+                    conn.executemany("DELETE FROM items WHERE month_key = ? AND tid = ?",
+                                     [(op["key"], tid) for tid in op["tids"]])
+                elif kind == "set":
+                    fields = {k: v for k, v in op["fields"].items() if k in ITEM_COLUMNS}
+                    if fields:
+                        assignments = ", ".join(f"{k} = ?" for k in fields)
+                        conn.execute(f"UPDATE items SET {assignments} WHERE month_key = ? AND tid = ?",
+                                     (*fields.values(), op["key"], op["tid"]))
+                elif kind == "bal":
+                    conn.execute(
+                        "INSERT INTO balances (year, account_id, amount) VALUES (?, ?, ROUND(?, 2)) "
+                        "ON CONFLICT(year, account_id) DO UPDATE SET amount = ROUND(amount + excluded.amount, 2)",
+                        (y, op["acc"], op["delta"]))
+                elif kind == "balances":
+                    conn.execute("DELETE FROM balances WHERE year = ?", (y,))
+                    conn.executemany("INSERT INTO balances (year, account_id, amount) VALUES (?, ?, ?)",
+                                     [(y, k, float(v)) for k, v in op["values"].items()])
+                elif kind == "template":
+                    conn.execute("DELETE FROM template WHERE year = ?", (y,))
+                    self._insert_template(conn, op["items"])
+                    conn.execute("UPDATE years SET next_id = MAX(next_id, ?) WHERE year = ?", (op["next_id"], y))
+                elif kind == "category":
+                    conn.execute(
+                        "INSERT OR IGNORE INTO categories (year, position, name) "
+                        "SELECT ?, COALESCE(MAX(position), -1) + 1, ? FROM categories WHERE year = ?",
+                        (y, op["name"], y))
+                else:
+                    raise ValueError(f"Operación desconocida: {kind}")
+            self._bump_rev(conn)
+        data["rev"] = self.revision
+
+    def _bump_rev(self, conn: sqlite3.Connection) -> None:
+        conn.execute("UPDATE years SET rev = rev + 1 WHERE year = ?", (self.year,))
+        self.revision = conn.execute("SELECT rev FROM years WHERE year = ?", (self.year,)).fetchone()["rev"]
+
+    def _insert_template(self, conn: sqlite3.Connection, template: List[Dict[str, Any]]) -> None:
+        conn.executemany(
+            f"INSERT INTO template (year, position, {', '.join(TEMPLATE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * (len(TEMPLATE_COLUMNS) + 2))})",
+            [(self.year, pos, int(t["id"]), t["name"], float(t["amount"]), int(t["account_id"]),
+              t.get("category", "Otros"), int(t.get("day", 1)), t["type"], int(t.get("annual_month") or 0))
+             for pos, t in enumerate(template)])
+
+    def _insert_month(self, conn: sqlite3.Connection, key: str, month: Dict[str, Any]) -> None:
+        conn.execute("INSERT INTO months (year, month_key, month) VALUES (?, ?, ?)",
+                     (self.year, key, int(month["month"])))
+        conn.executemany(f"INSERT INTO items VALUES ({', '.join('?' * 12)})",
+                         [_item_row(key, item) for item in month["items"]])
+
+    def query_items(self, month_key: str) -> Optional[List[Dict[str, Any]]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(ITEM_COLUMNS)} FROM items WHERE month_key = ? ORDER BY due",
+                (month_key,)).fetchall()
+        return [_item_from_row(r) for r in rows]
+
+    def query_summary(self, month_keys: Iterable[str], by: str) -> Optional[List[Dict[str, Any]]]:
+        column = SUMMARY_GROUPS[by]
+        keys = list(month_keys)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {column} AS grp, SUM(amount) AS total, SUM(paid) AS paid_count, "
+                "COUNT(*) - SUM(paid) AS pending_count, "
+                "SUM(CASE WHEN paid THEN amount ELSE 0 END) AS paid_amount, "
+                "SUM(CASE WHEN paid THEN 0 ELSE amount END) AS pending_amount "
+                f"FROM items WHERE month_key IN ({', '.join('?' * len(keys))}) GROUP BY {column}",
+                keys).fetchall()
+        return [dict(r) for r in rows]
+
+
+# -----------------------
+# Fábrica y migración
+# -----------------------
+SQLITE_DB_NAME = "accountcontrol.db"
+
+
+def open_storage(backend: str, data_dir: Path, year: int, journal: bool = True,
+                 compact_every: int = 200, generations: int = 3,
+                 snapshot_format: str = "json") -> Storage:
+    """Crea el backend configurado ("json" o "sqlite") para un año.
+
+    snapshot_format ("json" o "msgpack") solo afecta al backend de ficheros.
+    """
+    if backend == "sqlite":
+        return SqliteStorage(data_dir / SQLITE_DB_NAME, year)
+    if backend == "json":
+        return JsonStorage(data_dir / f"control_pagos_{year}.json",
+                           data_dir / f"control_pagos_{year}.journal.jsonl",
+                           journal=journal, compact_every=compact_every,
+                           generations=generations, snapshot_format=snapshot_format)
+    raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
+
+
+def json_years(data_dir: Path) -> List[int]:
+    """Años con instantánea control_pagos_{year}.json (o .msgpack) en data_dir"""
+    return sorted({int(p.stem.rsplit("_", 1)[1])
+                   for suffix in SNAPSHOT_SUFFIXES.values()
+                   for p in data_dir.glob(f"control_pagos_[0-9][0-9][0-9][0-9]{suffix}")})
+
+
+def convert_snapshots(data_dir: Path, fmt: str, years: Optional[Iterable[int]] = None) -> List[int]:
+    """Reescribe la instantánea de cada año en el formato indicado.
+
+    Incorpora el diario pendiente. Leer una instantánea msgpack requiere el
+    paquete msgpack. El fichero del otro formato se conserva, pero a partir de
+    ahora se cargará el recién escrito por ser el más reciente. Devuelve los
+    años convertidos.
+    """
+    converted = []
+    for year in (years if years is not None else json_years(data_dir)):
+        storage = open_storage("json", data_dir, year, snapshot_format=fmt)
+        with storage.locked():
+            data = storage.load()
+            if data is None:
+                continue
+            storage.write(data)
+        converted.append(year)
+    return converted
+
+
+def migrate_json_to_sqlite(data_dir: Path, db_path: Optional[Path] = None) -> List[int]:
+    """Copia todos los control_pagos_*.json (con su diario) a SQLite.
+
+    Sobrescribe los años ya presentes en la base de datos. Devuelve los años
+    migrados.
+    """
+    db_path = db_path or data_dir / SQLITE_DB_NAME
+    migrated = []
+    for year in json_years(data_dir):
+        source = open_storage("json", data_dir, year)
+        data = source.load()
+        if data is None:
+            continue
+        SqliteStorage(db_path, year).write(data)
+        migrated.append(year)
+    return migrated
+
+
+def available_years(backend: str, data_dir: Path) -> List[int]:
+    """Años con datos persistidos en el backend"""
+    if backend == "sqlite":
+        db_path = data_dir / SQLITE_DB_NAME
+        if not db_path.exists():
+            return []
+        with SqliteStorage(db_path, 0)._connect() as conn:
+            return [r["year"] for r in conn.execute("SELECT year FROM years ORDER BY year")]
+    return json_years(data_dir)
+
+
+def dataset_signature(backend: str, data_dir: Path) -> tuple:
+    """Huella barata de todos los años: cambia si cualquiera se modifica"""
+    if backend == "sqlite":
+        db_path = data_dir / SQLITE_DB_NAME
+        if not db_path.exists():
+            return ()
+        with SqliteStorage(db_path, 0)._connect() as conn:
+            return tuple(tuple(r) for r in conn.execute("SELECT year, rev FROM years ORDER BY year"))
+    return tuple((year, open_storage(backend, data_dir, year).stamp())
+                 for year in available_years(backend, data_dir))
@@ -0,0 +1,23 @@
+"""Vistas con gráficos de la app.
+
+Cada módulo dibuja una vista y carga plotly (y analytics) al importarse;
+app.py los importa solo cuando se selecciona su vista, así que el arranque
+en frío no paga esas dependencias hasta que se dibuja un gráfico. Las vistas
+con widgets son fragmentos (st.fragment): interactuar con ellas vuelve a
+ejecutar solo la vista, no la cabecera ni el resto de la página. Aquí solo
+viven utilidades de formato sin dependencias pesadas.
+"""
+
+
+def eur(x: float) -> str:
+    """Formato moneda europea"""
+    return f"{x:,.2f} €".replace(",", "X").replace(".", ",").replace("X", ".")
+
+def get_status_emoji(gap: float) -> str:
+    """Devuelve emoji según disponibilidad"""
+    if gap >= 100:
+        return "✅"
+    elif gap >= 0:
+        return "⚠️"
+    else:
+        return "🔴"
@@ -0,0 +1,148 @@
+"""Pestaña de Cuentas: tesorería, gráficos de saldos y ajuste manual"""
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+
+from core import FinanceManager, log_op
+from views import eur, get_status_emoji
+from views.figures import cached_figure
+
+
+def _balance_bar(df_accs: pd.DataFrame) -> go.Figure:
+    return px.bar(
+        df_accs,
+        x="Cuenta",
+        y=["Saldo Actual", "Pendiente"],
+        title="Comparativa Saldo vs Necesidades",
+        barmode='group',
+        color_discrete_map={"Saldo Actual": "#2ecc71", "Pendiente": "#e74c3c"}
+    )
+
+def _available_bar(df_accs: pd.DataFrame) -> go.Figure:
+    return px.bar(
+        df_accs,
+        x="Cuenta",
+        y="Disponible",
+        title="Disponibilidad Real por Cuenta",
+        color="Disponible",
+        color_continuous_scale=["red", "yellow", "green"],
+        color_continuous_midpoint=0
+    )
+
+@st.fragment
+def render(manager: FinanceManager, month: int):
+    """Saldos frente a pendientes por cuenta y ajuste manual de saldos"""
+    st.subheader("🏦 Estado de Tesorería")
+    
+    # Necesidades por cuenta (totales mantenidos por el gestor)
+    totals = manager.month_totals(month)
+    pending_by_acc = {aid: t.pending for aid, t in totals.by_account.items()}
+    
+    acc_data = []
+    total_gap = 0
+    total_balance = 0
+    total_pending = 0
+    
+    for acc in manager.data["accounts"]:
+        aid = str(acc["id"])
+        bal = float(manager.data["balances"].get(aid, 0.0))
+        need = pending_by_acc.get(acc["id"], 0.0)
+        gap = bal - need
+        
+        status = get_status_emoji(gap)
+        
+        if gap < 0:
+            total_gap += abs(gap)
+        
+        total_balance += bal
+        total_pending += need
+        
+        acc_data.append({
+            "": status,
+            "Cuenta": acc["name"],
+            "Saldo Actual": bal,
+            "Pendiente": need,
+            "Disponible": gap,
+        })
+    
+    df_accs = pd.DataFrame(acc_data)
+    
+    # Alertas globales
+    if total_gap > 0:
+        st.markdown(f"""
+        <div class="alert-card">
+            <h4>⚠️ Atención: Déficit Detectado</h4>
+            <p>Necesitas <strong>{eur(total_gap)}</strong> adicionales para cubrir todos los pagos pendientes.</p>
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        surplus = total_balance - total_pending
+        st.markdown(f"""
+        <div class="success-card">
+            <h4>🎉 ¡Fondos Suficientes!</h4>
+            <p>Todas las cuentas están cubiertas. Excedente: <strong>{eur(surplus)}</strong></p>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    # Tabla de cuentas
+    st.dataframe(
+        df_accs,
+        column_config={
+            "": st.column_config.TextColumn("", width="small"),
+            "Saldo Actual": st.column_config.ProgressColumn(
+                "Saldo",
+                format="%.2f €",
+                min_value=0,
+                max_value=df_accs["Saldo Actual"].max() if not df_accs.empty else 1000
+            ),
+            "Pendiente": st.column_config.NumberColumn(format="%.2f €"),
+            "Disponible": st.column_config.NumberColumn(
+                format="%.2f €",
+            ),
+        },
+        hide_index=True,
+        use_container_width=True
+    )
+    
+    st.divider()
+    
+    # Gráfico de saldos
+    col_chart1, col_chart2 = st.columns(2)
+    
+    with col_chart1:
+        fig_bal = cached_figure(manager, month, "balance_bar", lambda: _balance_bar(df_accs))
+        st.plotly_chart(fig_bal, use_container_width=True)
+    
+    with col_chart2:
+        # Disponible real
+        fig_disp = cached_figure(manager, month, "available_bar", lambda: _available_bar(df_accs))
+        st.plotly_chart(fig_disp, use_container_width=True)
+    
+    st.divider()
+    
+    # Ajuste manual de saldos
+    with st.expander("🛠️ Ajustar Saldos Manualmente"):
+        st.info("💡 Usa esto para sincronizar con tus saldos bancarios reales")
+        
+        with st.form("manual_balance"):
+            cols = st.columns(len(manager.data["accounts"]))
+            new_bals = {}
+            
+            for idx, acc in enumerate(manager.data["accounts"]):
+                with cols[idx]:
+                    aid = str(acc["id"])
+                    current_bal = float(manager.data["balances"].get(aid, 0.0))
+                    val = st.number_input(
+                        f"{acc['name']}", 
+                        value=current_bal, 
+                        step=50.0,
+                        key=f"bal_{aid}"
+                    )
+                    new_bals[aid] = val
+            
+            if st.form_submit_button("💾 Actualizar Todos los Saldos", type="primary"):
+                manager.set_balances(new_bals)
+                st.success("✅ Saldos actualizados correctamente")
+                log_op("BALANCE_UPDATE", f"Saldos actualizados manualmente")
+                st.rerun()
@@ -0,0 +1,181 @@
+"""Pestaña de Análisis: distribución, timeline y estado de pagos del mes"""
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+
+import analytics
+from core import FinanceManager
+from views.figures import cached_figure, cached_figure_payload
+
+# Agrupaciones del timeline (etiqueta -> analytics.timeline)
+TIMELINE_GROUPS = {"Item": "item", "Día": "day", "Semana": "week"}
+# A partir de cuántos puntos por serie se usan trazas WebGL (Scattergl)
+TIMELINE_WEBGL_POINTS = 500
+
+
+def _account_pie(df_items: pd.DataFrame) -> go.Figure:
+    grp_acc = df_items.groupby("account_name", observed=True)["amount"].sum().reset_index()
+    fig_pie = px.pie(
+        grp_acc,
+        values="amount",
+        names="account_name",
+        hole=0.5,
+        color_discrete_sequence=px.colors.qualitative.Set3
+    )
+    fig_pie.update_traces(textposition='inside', textinfo='percent+label')
+    return fig_pie
+
+def _category_bar(df_items: pd.DataFrame) -> go.Figure:
+    grp_cat = df_items.groupby("category", observed=True)["amount"].sum().reset_index()
+    grp_cat = grp_cat.sort_values("amount", ascending=False).head(8)
+    fig_cat = px.bar(
+        grp_cat,
+        x="amount",
+        y="category",
+        orientation='h',
+        color="amount",
+        color_continuous_scale="Blues"
+    )
+    fig_cat.update_layout(showlegend=False)
+    return fig_cat
+
+def _timeline(table: pd.DataFrame, webgl: bool) -> go.Figure:
+    # Con muchos puntos, WebGL dibuja en el navegador mucho más rápido que SVG
+    scatter = go.Scattergl if webgl and len(table) > TIMELINE_WEBGL_POINTS else go.Scatter
+
+    fig_timeline = go.Figure()
+
+    # Línea acumulada
+    fig_timeline.add_trace(scatter(
+        x=table["due"],
+        y=table["acumulado"],
+        mode='lines+markers',
+        name='Acumulado',
+        line=dict(color='#1f77b4', width=3),
+        fill='tozeroy'
+    ))
+
+    # Marcar pagados vs pendientes
+    paid_items = table[table["paid"] > 0]
+    pending_items = table[table["pending"] > 0]
+
+    fig_timeline.add_trace(scatter(
+        x=paid_items["due"],
+        y=paid_items["paid"],
+        mode='markers',
+        name='Pagados',
+        marker=dict(size=12, color='green', symbol='circle')
+    ))
+
+    fig_timeline.add_trace(scatter(
+        x=pending_items["due"],
+        y=pending_items["pending"],
+        mode='markers',
+        name='Pendientes',
+        marker=dict(size=12, color='red', symbol='x')
+    ))
+
+    fig_timeline.update_layout(
+        hovermode='x unified',
+        height=400
+    )
+    return fig_timeline
+
+def _timeline_items(manager: FinanceManager, month: int) -> pd.DataFrame:
+    """Items del mes, o de todo el año con month=0.
+
+    Los meses sin items devuelven un DataFrame sin columnas y se omiten; la
+    vista solo se dibuja si el mes seleccionado tiene items, así que siempre
+    queda al menos uno.
+    """
+    months = range(1, 13) if month == 0 else [month]
+    frames = [manager.get_items_df(m) for m in months]
+    return pd.concat([df[["due", "amount", "paid"]] for df in frames if not df.empty],
+                     ignore_index=True)
+
+@st.fragment
+def _render_timeline(manager: FinanceManager, month: int):
+    """Timeline agregado en el servidor; sus controles solo reejecutan esta sección"""
+    col_period, col_group, col_gl = st.columns([1, 2, 1])
+    with col_period:
+        period = st.radio("Periodo", ["Mes", "Año"], horizontal=True, key="timeline_period")
+    with col_group:
+        group_label = st.radio("Agrupar", list(TIMELINE_GROUPS), index=1, horizontal=True,
+                               key="timeline_group")
+    with col_gl:
+        webgl = st.toggle("WebGL", value=True, key="timeline_webgl",
+                          help=f"Usa Scattergl con más de {TIMELINE_WEBGL_POINTS} puntos")
+
+    scope = month if period == "Mes" else 0
+    group = TIMELINE_GROUPS[group_label]
+    fig_timeline, (points, size) = cached_figure_payload(
+        manager, scope, f"timeline:{group}:{webgl}",
+        lambda: _timeline(analytics.timeline(_timeline_items(manager, scope), group), webgl)
+    )
+    st.plotly_chart(fig_timeline, use_container_width=True)
+    st.caption(f"📦 {points} puntos · {size / 1024:.1f} KB enviados al navegador")
+
+def _status_bar(manager: FinanceManager, month: int) -> go.Figure:
+    status_data = []
+    by_account = manager.month_totals(month).by_account
+    for acc in manager.data["accounts"]:
+        tally = by_account.get(acc["id"])
+        if tally is None or tally.count == 0:
+            continue
+        status_data.append({
+            "Cuenta": acc["name"],
+            "Pagado": tally.paid,
+            "Pendiente": tally.pending
+        })
+
+    df_status = pd.DataFrame(status_data)
+
+    fig_status = go.Figure()
+    fig_status.add_trace(go.Bar(
+        name='Pagado',
+        x=df_status["Cuenta"],
+        y=df_status["Pagado"],
+        marker_color='#2ecc71'
+    ))
+    fig_status.add_trace(go.Bar(
+        name='Pendiente',
+        x=df_status["Cuenta"],
+        y=df_status["Pendiente"],
+        marker_color='#e74c3c'
+    ))
+
+    fig_status.update_layout(barmode='stack', height=400)
+    return fig_status
+
+def render(manager: FinanceManager, month: int):
+    """Gráficos del mes: por cuenta, por categoría, timeline y estado"""
+    df_items = manager.get_items_df(month)
+
+    if df_items.empty:
+        st.info("No hay datos para visualizar")
+    else:
+        # Gráficos mejorados
+        col_g1, col_g2 = st.columns(2)
+
+        with col_g1:
+            st.subheader("📊 Distribución por Cuenta")
+            fig_pie = cached_figure(manager, month, "account_pie", lambda: _account_pie(df_items))
+            st.plotly_chart(fig_pie, use_container_width=True)
+
+        with col_g2:
+            st.subheader("🏷️ Distribución por Categoría")
+            fig_cat = cached_figure(manager, month, "category_bar", lambda: _category_bar(df_items))
+            st.plotly_chart(fig_cat, use_container_width=True)
+
+        st.divider()
+
+        # Timeline de pagos
+        st.subheader("📅 Timeline de Pagos")
+        _render_timeline(manager, month)
+
+        # Comparativa Estado
+        st.divider()
+        st.subheader("✅ Estado de Pagos por Cuenta")
+        fig_status = cached_figure(manager, month, "status", lambda: _status_bar(manager, month))
+        st.plotly_chart(fig_status, use_container_width=True)
@@ -0,0 +1,94 @@
+"""Pestaña de Categorías: resumen, treemap y gestión de categorías"""
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+
+from core import FinanceManager
+from views import eur
+from views.figures import cached_figure
+
+
+def _treemap(summary: pd.DataFrame) -> go.Figure:
+    fig_tree = px.treemap(
+        summary,
+        path=['Categoría'],
+        values='Total',
+        color='Total',
+        color_continuous_scale='RdYlGn_r',
+        hover_data={'Total': ':,.2f'}
+    )
+    fig_tree.update_traces(textinfo="label+value+percent parent")
+    return fig_tree
+
+@st.fragment
+def render(manager: FinanceManager, month: int):
+    """Resumen del mes por categoría y alta de categorías nuevas"""
+    st.subheader("📁 Análisis por Categorías")
+    
+    summary = manager.get_category_summary(month)
+    
+    if summary.empty:
+        st.info("No hay datos de categorías")
+    else:
+        # Métricas de categorías
+        col_m1, col_m2, col_m3 = st.columns(3)
+        
+        with col_m1:
+            st.metric("Categorías activas", len(summary))
+        
+        with col_m2:
+            top_cat = summary.iloc[0]
+            st.metric("Mayor gasto", top_cat["Categoría"], eur(top_cat["Total"]))
+        
+        with col_m3:
+            avg_per_cat = summary["Total"].mean()
+            st.metric("Promedio/Categoría", eur(avg_per_cat))
+        
+        st.divider()
+        
+        # Tabla detallada
+        st.dataframe(
+            summary,
+            column_config={
+                "Total": st.column_config.ProgressColumn(
+                    "Total",
+                    format="%.2f €",
+                    min_value=0,
+                    max_value=summary["Total"].max()
+                ),
+                "Pagados": st.column_config.NumberColumn("Items Pagados"),
+                "Pendientes": st.column_config.NumberColumn("Items Pendientes"),
+                "Importe Pagado": st.column_config.NumberColumn(format="%.2f €"),
+                "Importe Pendiente": st.column_config.NumberColumn(format="%.2f €"),
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+        
+        st.divider()
+        
+        # Treemap de categorías
+        st.subheader("🗺️ Mapa de Gastos por Categoría")
+        fig_tree = cached_figure(manager, month, "treemap", lambda: _treemap(summary))
+        st.plotly_chart(fig_tree, use_container_width=True)
+        
+        # Gestión de categorías
+        st.divider()
+        with st.expander("⚙️ Gestionar Categorías"):
+            current_cats = manager.data.get("categories", [])
+            
+            col_cat1, col_cat2 = st.columns(2)
+            
+            with col_cat1:
+                st.write("**Categorías Actuales:**")
+                for cat in current_cats:
+                    st.write(f"• {cat}")
+            
+            with col_cat2:
+                new_cat = st.text_input("Nueva Categoría")
+                if st.button("➕ Agregar Categoría"):
+                    if new_cat and new_cat not in current_cats:
+                        manager.add_category(new_cat)
+                        st.success(f"✅ Categoría '{new_cat}' agregada")
+                        st.rerun()
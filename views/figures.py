@@ -0,0 +1,84 @@
+"""Caché de figuras plotly por (año, mes, revisión de datos, gráfico).
+
+Construir una figura con plotly.express cuesta decenas de milisegundos y
+los datos de un mes solo cambian cuando cambia la revisión del año, así que
+las figuras se guardan ya construidas y se comparten entre sesiones. Se
+guarda el objeto Figure y no su JSON: st.plotly_chart vuelve a validar
+cualquier dict o JSON, mientras que una Figure ya validada solo se serializa.
+
+Cada hueco (año, mes, gráfico) conserva solo la figura de la última
+revisión y los huecos se descartan en orden LRU, así que la memoria no
+crece al recorrer muchos meses. Al construir una figura se mide también
+lo que pesa en el navegador (puntos de datos y bytes del JSON enviado).
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+import plotly.graph_objects as go
+import plotly.io as pio
+import streamlit as st
+
+from core import FinanceManager
+
+# Huecos (año, mes, gráfico) que se conservan entre todas las sesiones
+FIGURE_CACHE_SIZE = 64
+
+
+def figure_payload(fig: go.Figure) -> Tuple[int, int]:
+    """(puntos, bytes) que st.plotly_chart envía al navegador para la figura"""
+    points = sum(len(trace.x) for trace in fig.data if getattr(trace, "x", None) is not None)
+    return points, len(pio.to_json(fig, validate=False).encode("utf-8"))
+
+
+class FigureCache:
+    """LRU de figuras; cada hueco recuerda la revisión con la que se construyó"""
+
+    def __init__(self, max_entries: int = FIGURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        # (año, mes, gráfico) -> (revisión, figura, (puntos, bytes))
+        self._figures: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, year: int, month: int, revision: int, chart: str,
+                     build: Callable[[], go.Figure]) -> Tuple[go.Figure, Tuple[int, int]]:
+        """Figura del hueco y su peso (puntos, bytes); se construye si la revisión cambió"""
+        slot = (year, month, chart)
+        with self._lock:
+            cached = self._figures.get(slot)
+            if cached is not None and cached[0] == revision:
+                self._figures.move_to_end(slot)
+                return cached[1], cached[2]
+        # Se construye fuera del candado: otra sesión puede dibujar mientras tanto
+        fig = build()
+        payload = figure_payload(fig)
+        with self._lock:
+            self._figures[slot] = (revision, fig, payload)
+            self._figures.move_to_end(slot)
+            while len(self._figures) > self.max_entries:
+                self._figures.popitem(last=False)
+        return fig, payload
+
+    def __len__(self) -> int:
+        return len(self._figures)
+
+
+@st.cache_resource(show_spinner=False)
+def get_figure_cache() -> FigureCache:
+    """Caché compartida por todas las sesiones del proceso"""
+    return FigureCache()
+
+def cached_figure_payload(manager: FinanceManager, month: int, chart: str,
+                          build: Callable[[], go.Figure]) -> Tuple[go.Figure, Tuple[int, int]]:
+    """Figura `chart` del mes y su peso (puntos, bytes).
+
+    `build` solo se llama si los datos del año cambiaron; month=0 identifica
+    gráficos de todo el año. Las figuras son compartidas: quien las recibe
+    no debe modificarlas.
+    """
+    return get_figure_cache().get_or_build(manager.year, month, manager.version, chart, build)
+
+def cached_figure(manager: FinanceManager, month: int, chart: str,
+                  build: Callable[[], go.Figure]) -> go.Figure:
+    """Figura `chart` del mes (ver cached_figure_payload)"""
+    return cached_figure_payload(manager, month, chart, build)[0]
@@ -0,0 +1,73 @@
+"""Pestaña de Tendencias: gasto de todos los meses y años"""
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+
+import analytics
+import core
+from storage import dataset_signature
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _analytics_cube(signature: tuple) -> pd.DataFrame:
+    """Agregado mes × categoría × cuenta de todos los años.
+
+    `signature` (huella de los ficheros/revisiones) solo actúa como clave
+    de caché: la tabla se reconstruye únicamente cuando algún año cambia.
+    """
+    items = analytics.load_items_table(core.STORAGE_BACKEND, core.DATA_DIR)
+    return analytics.rollup(items)
+
+@st.fragment
+def render():
+    """Tendencias de gasto a través de todos los meses y años"""
+    st.subheader("📈 Tendencias Multi-Año")
+    
+    cube = _analytics_cube(dataset_signature(core.STORAGE_BACKEND, core.DATA_DIR))
+    if cube.empty:
+        st.info("No hay datos históricos todavía")
+        return
+    
+    years = sorted(int(y) for y in cube["year"].unique())
+    col_y, col_g, col_v = st.columns([2, 1, 1])
+    with col_y:
+        selected_years = st.multiselect("Años", years, default=years, key="trend_years")
+    with col_g:
+        group_label = st.radio("Agrupar por", ["Categoría", "Cuenta"], horizontal=True, key="trend_group")
+    with col_v:
+        value_label = st.radio("Importe", ["Total", "Pendiente"], horizontal=True, key="trend_value")
+    
+    if not selected_years:
+        st.info("Selecciona al menos un año")
+        return
+    
+    by = "category" if group_label == "Categoría" else "account_name"
+    value = "total" if value_label == "Total" else "pending_amount"
+    table = analytics.trend(cube, by, selected_years, value)
+    table.columns = table.columns.astype(str)
+    
+    fig_trend = px.bar(
+        table,
+        barmode="stack",
+        labels={"month_key": "Mes", "value": "Importe (€)", "variable": group_label},
+        color_discrete_sequence=px.colors.qualitative.Set3
+    )
+    fig_trend.update_layout(height=450)
+    st.plotly_chart(fig_trend, use_container_width=True)
+    
+    # Totales del periodo por grupo
+    totals = table.sum().sort_values(ascending=False).rename("Importe").reset_index()
+    totals.columns = [group_label, "Importe"]
+    st.dataframe(
+        totals,
+        column_config={
+            "Importe": st.column_config.ProgressColumn(
+                "Importe",
+                format="%.2f €",
+                min_value=0,
+                max_value=float(totals["Importe"].max()) if not totals.empty else 1.0
+            ),
+        },
+        hide_index=True,
+        use_container_width=True
+    )